@@ -0,0 +1,57 @@
+'''
+Measures the cold start cost of us_census: the time to import
+us_census.us_census and construct a DataReader in a fresh interpreter, and
+which heavy dependencies were loaded by then.
+
+    python benchmarks/import_time.py [repeat]
+
+For a per-module breakdown, run
+    python -X importtime -c "from us_census.us_census import DataReader"
+'''
+
+__author__ = 'linanqiu'
+
+import subprocess
+import sys
+
+# Dependencies that should only be imported once a query runs
+HEAVY_MODULES = ['pandas', 'numpy', 'census', 'requests', 'us']
+
+SNIPPET = '''
+import sys
+import time
+start = time.perf_counter()
+from us_census.us_census import DataReader
+imported = time.perf_counter()
+DataReader('population', None)
+DataReader('household', None)
+constructed = time.perf_counter()
+loaded = [module for module in %r if module in sys.modules]
+print('%%f %%f %%s' %% (imported - start, constructed - imported, ','.join(loaded)))
+''' % HEAVY_MODULES
+
+
+def measure():
+    output = subprocess.check_output([sys.executable, '-c', SNIPPET], universal_newlines=True).split()
+    loaded = output[2].split(',') if len(output) > 2 else []
+    return float(output[0]), float(output[1]), loaded
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+    # the first run compiles bytecode, so it is not counted
+    measure()
+    results = [measure() for _ in range(repeat)]
+
+    import_times = sorted(result[0] for result in results)
+    construct_times = sorted(result[1] for result in results)
+    print('import us_census.us_census: median %.1f ms, min %.1f ms' % (
+        1000 * import_times[len(import_times) // 2], 1000 * import_times[0]))
+    print('construct DataReader:       median %.2f ms, min %.2f ms' % (
+        1000 * construct_times[len(construct_times) // 2], 1000 * construct_times[0]))
+    print('heavy modules loaded:       %s' % (', '.join(results[-1][2]) or 'none'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+'''
+Benchmarks of variable lookup, response post-processing and end-to-end reads
+for every geography shape, against the local stub of the Census API in
+stub_api.py. Each benchmark is timed with timeit, and results can be saved
+and compared against an earlier run to catch regressions.
+
+    python benchmarks/run.py [-k pattern] [--repeat 5] [--scale 1.0]
+                             [--save results.json] [--compare baseline.json]
+
+Comparing exits with status 1 if any benchmark got slower than the threshold.
+'''
+
+__author__ = 'linanqiu'
+
+# Ratio of the new to the baseline median above which a benchmark counts as
+# a regression
+THRESHOLD = 1.25
+
+import argparse
+import json
+import logging
+import shutil
+import sys
+import tempfile
+import timeit
+
+import pandas
+
+import stub_api
+from us_census import geography, household, lookup, population
+
+# Geography filters of every shape handled by query_census_chunk, from one
+# state up to every tract of the country
+READ_SHAPES = [
+    ('state_one', {'state': 'OH'}),
+    ('state_all', {'state': '*'}),
+    ('county_state', {'state': 'OH', 'county': '*'}),
+    ('county_all', {'state': '*', 'county': '*'}),
+    ('subdivision_state', {'state': 'OH', 'county': '*', 'subdivision': '*'}),
+    ('tract_county', {'state': 'OH', 'county': '035', 'tract': '*'}),
+    ('tract_state', {'state': 'OH', 'county': '*', 'tract': '*'}),
+    ('tract_all', {'state': '*', 'county': '*', 'tract': '*'}),
+    ('place_state', {'state': 'OH', 'place': '*'}),
+    ('district_state', {'state': 'OH', 'district': '*'}),
+    ('district_place_state', {'state': 'OH', 'district': '*', 'place': '*'}),
+    ('msa_state', {'state': 'OH', 'msa': '*'}),
+    ('csa_state', {'state': 'OH', 'csa': '*'}),
+    ('zipcode_state', {'state': 'OH', 'zipcode': '*'}),
+]
+
+# Parameters of the end-to-end reads: 100 variables, i.e. three chunk requests
+READ_PARAMS = {'sex': 'male', 'age': range(0, 100)}
+
+
+def worst_case_params(reader):
+    '''
+    Parameters selecting every value of every dimension, the most expensive
+    input of filter_api_variable
+    :param reader: reader whose lookup table is used
+    :type reader: reader.CensusReader
+    :return: parameters as taken by read
+    :rtype: dict
+    '''
+    return {dimension: sorted(values, key=str) for dimension, values in reader.api_index.values.items()}
+
+
+def response_frame(symbols, units):
+    '''
+    Synthetic query_census result of units counties, for benchmarking the
+    post-processing of read without any request
+    :param symbols: variable columns
+    :type symbols: list[str]
+    :param units: number of rows
+    :type units: int
+    :return: frame with state, county and variable columns
+    :rtype: pandas.DataFrame
+    '''
+    import numpy
+
+    states = geography.state_fips_codes()
+    values = numpy.random.RandomState(0).randint(0, 1000, size=(units, len(symbols)))
+    dataframe = pandas.DataFrame(values.astype(float), columns=symbols)
+    dataframe['state'] = [states[i % len(states)] for i in range(units)]
+    dataframe['county'] = [str(i // len(states) * 2 + 1).zfill(3) for i in range(units)]
+    return dataframe
+
+
+def benchmarks(base_url):
+    '''
+    Builds the benchmarks as (name, setup, statement, number) tuples. setup
+    runs before each timed batch of number calls of statement
+    :param base_url: base URL of the stub server
+    :type base_url: str
+    :return: list of benchmarks
+    :rtype: list[tuple]
+    '''
+    # variables are not minimized, so that the reads below keep sending READ_PARAMS in three chunks
+    def reader(module, minimize=False):
+        return stub_api.install(module(CENSUS_API_KEY='benchmark', cache=False, variable_cache=False,
+                                       result_cache=False, minimize=minimize), base_url)
+
+    population_reader = reader(population.PopulationReader)
+    household_reader = reader(household.HouseholdReader)
+    result = []
+
+    # lookup tables: parsing the csv, loading the snapshot, and the in-process memo
+    snapshot_dir = tempfile.mkdtemp(prefix='us_census_benchmark')
+
+    def clear_snapshots():
+        lookup.loaded_tables.clear()
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+        lookup.SNAPSHOT_DIR = snapshot_dir
+
+    for name, cold in [('population', population.PopulationReader), ('household', household.HouseholdReader)]:
+        result.append(('read_api_lookup_csv_%s' % name, clear_snapshots,
+                       lambda cold=cold: cold('benchmark').read_api_lookup(), 1))
+        result.append(('read_api_lookup_snapshot_%s' % name, lookup.loaded_tables.clear,
+                       lambda cold=cold: cold('benchmark').read_api_lookup(), 1))
+        result.append(('read_api_lookup_memo_%s' % name, lambda: None,
+                       lambda cold=cold: cold('benchmark').read_api_lookup(), 100))
+
+    # variable filtering for the widest parameters
+    for name, target in [('population', population_reader), ('household', household_reader)]:
+        params = worst_case_params(target)
+
+        result.append(('filter_api_variable_worst_%s' % name, lambda: None,
+                       lambda target=target, params=params: target.filter_api_variable(params), 100))
+
+    # post-processing of read on all counties, without requests
+    api_variables = population_reader.filter_api_variable(READ_PARAMS)
+    symbols = api_variables['row_id'].tolist()
+    counties = response_frame(symbols, 3200)
+    county_geo = {'state': '*', 'county': '*'}
+    result.append(('aggregate_county_all', lambda: None,
+                   lambda: population_reader.aggregate(counties, symbols, county_geo), 10))
+    result.append(('aggregate_breakdown_county_all', lambda: None,
+                   lambda: population_reader.aggregate_breakdown(counties, api_variables, ['age'], county_geo), 3))
+
+    # end-to-end reads against the stub, replayed after the first request
+    for name, geo in READ_SHAPES:
+        result.append(('read_%s' % name, lambda: None,
+                       lambda geo=geo: population_reader.read(geo, READ_PARAMS), 1))
+    minimized_reader = reader(population.PopulationReader, minimize=True)
+    result.append(('read_minimized_county_all', lambda: None,
+                   lambda: minimized_reader.read(county_geo, READ_PARAMS), 1))
+    memo_reader = stub_api.install(population.PopulationReader(CENSUS_API_KEY='benchmark', cache=False,
+                                                               variable_cache=False), base_url)
+    result.append(('read_memo_county_all', lambda: None, lambda: memo_reader.read(county_geo, READ_PARAMS), 100))
+    result.append(('read_household_county_all', lambda: None,
+                   lambda: household_reader.read({'state': '*', 'county': '*'}, {'type': 'husband_wife'}), 1))
+
+    return result
+
+
+def run(selected, repeat):
+    '''
+    Times each benchmark repeat times, after one untimed warm-up batch that
+    also fills the replay cache of the stub
+    :param selected: benchmarks as returned by benchmarks
+    :type selected: list[tuple]
+    :param repeat: number of timed batches
+    :type repeat: int
+    :return: benchmark name to seconds per call of the median and fastest batch
+    :rtype: dict
+    '''
+    results = {}
+    for name, setup, statement, number in selected:
+        setup()
+        statement()
+        times = []
+        for _ in range(repeat):
+            setup()
+            times.append(timeit.timeit(statement, number=number) / number)
+        times.sort()
+        results[name] = {'median': times[len(times) // 2], 'min': times[0]}
+        print('%-36s median %10.3f ms   min %10.3f ms' % (name, 1000 * times[len(times) // 2], 1000 * times[0]))
+        sys.stdout.flush()
+    return results
+
+
+def compare(results, baseline_path, threshold=THRESHOLD):
+    '''
+    Prints the change of each benchmark against a saved run
+    :param results: results of run
+    :type results: dict
+    :param baseline_path: JSON file saved by an earlier run
+    :type baseline_path: str
+    :param threshold: ratio of medians counted as a regression
+    :type threshold: float
+    :return: names of the regressed benchmarks
+    :rtype: list[str]
+    '''
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)
+
+    regressions = []
+    for name in sorted(set(results) & set(baseline)):
+        ratio = results[name]['median'] / baseline[name]['median']
+        flag = ''
+        if ratio > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print('%-36s %6.2fx%s' % (name, ratio, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks us_census against a local stub of the Census API')
+    parser.add_argument('-k', dest='pattern', default='', help='only run benchmarks whose name contains pattern')
+    parser.add_argument('--repeat', type=int, default=5, help='number of timed batches per benchmark')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplier of the number of stub geographies')
+    parser.add_argument('--save', help='write the results to a JSON file')
+    parser.add_argument('--compare', help='compare against results saved with --save')
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+
+    process, base_url = stub_api.start(args.scale)
+    try:
+        selected = [benchmark for benchmark in benchmarks(base_url) if args.pattern in benchmark[0]]
+        results = run(selected, args.repeat)
+    finally:
+        process.terminate()
+
+    if args.save:
+        with open(args.save, 'w') as results_file:
+            json.dump(results, results_file, indent=1, sort_keys=True)
+
+    if args.compare and compare(results, args.compare):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+'''
+Local stand-in for the 2010 SF1 Census API, serving synthetic responses with
+the shape of the real ones so that reads can be benchmarked without a network
+or an API key. Responses are generated once per URL and replayed from memory
+afterwards.
+
+    python benchmarks/stub_api.py [port]
+'''
+
+__author__ = 'linanqiu'
+
+# Number of units of each geography within one unit of its parent, roughly
+# the national averages of the 2010 census
+SIZES = {
+    'county': 60,
+    'tract': 23,
+    'county subdivision': 20,
+    'place': 30,
+    'congressional district': 8,
+    'place/remainder (or part)': 10,
+    'metropolitan statistical area/micropolitan statistical area (or part)': 8,
+    'combined statistical area (or part)': 3,
+    'zip code tabulation area (or part)': 60,
+}
+
+# Width of the codes of each geography
+WIDTHS = {
+    'state': 2,
+    'county': 3,
+    'tract': 6,
+    'county subdivision': 5,
+    'place': 5,
+    'congressional district': 2,
+    'place/remainder (or part)': 5,
+    'metropolitan statistical area/micropolitan statistical area (or part)': 5,
+    'combined statistical area (or part)': 3,
+    'zip code tabulation area (or part)': 5,
+}
+
+# Host whose requests are answered by the stub
+CENSUS_HOST = 'https://api.census.gov'
+
+import itertools
+import json
+import multiprocessing
+import re
+import sys
+import threading
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy
+import requests.adapters
+
+from us_census.geography import state_fips_codes
+
+GEO_CLAUSE = re.compile(r'\s*([a-z/ ()]+?):(\S+)')
+
+
+def codes(geography, value, scale):
+    '''
+    Codes of the units of a geography selected by value, e.g. '*' or '035'
+    :param geography: geography name as used by the API, e.g. 'county'
+    :type geography: str
+    :param value: code of a single unit or '*' for all of them
+    :type value: str
+    :param scale: multiplier of SIZES
+    :type scale: float
+    :return: unit codes
+    :rtype: list[str]
+    '''
+    if value != '*':
+        return [value]
+    if geography == 'state':
+        return state_fips_codes()
+    count = max(1, int(round(SIZES[geography] * scale)))
+    return [str(2 * i + 1).zfill(WIDTHS[geography]) for i in range(count)]
+
+
+def unit_values(fields, geographies, units):
+    '''
+    Synthetic values of variables for units, a deterministic function of the
+    variable and the unit, so that every request, however its variables are
+    chunked and its units planned, returns the same value for a cell
+    :param fields: variables
+    :type fields: list[str]
+    :param geographies: geography of each code of a unit, e.g. ['state', 'county']
+    :type geographies: list[str]
+    :param units: codes of each unit, e.g. [('39', '035')]
+    :type units: list[tuple]
+    :return: integer values between 0 and 999, one row per unit
+    :rtype: numpy.ndarray
+    '''
+    unit_hashes = numpy.array([zlib.crc32('|'.join('%s:%s' % pair for pair in zip(geographies, unit)).encode('utf-8'))
+                               for unit in units], dtype=numpy.uint64)
+    field_hashes = numpy.array([zlib.crc32(field.encode('utf-8')) for field in fields], dtype=numpy.uint64)
+    # multiplicative hashing of both codes, wrapping around 64 bits
+    mixed = (unit_hashes[:, None] * numpy.uint64(2654435761)) ^ (field_hashes[None, :] * numpy.uint64(40503))
+    mixed = mixed * numpy.uint64(11400714819323198485)
+    return ((mixed >> numpy.uint64(32)) % numpy.uint64(1000)).astype(numpy.int64)
+
+
+def response(query, scale):
+    '''
+    Builds the JSON body of a data request: a header row of variables and
+    geographies, then one row of string values per unit
+    :param query: parsed query string with get, for and optionally in
+    :type query: dict
+    :param scale: multiplier of SIZES
+    :type scale: float
+    :return: JSON body
+    :rtype: bytes
+    '''
+    fields = query['get'][0].split(',')
+    clauses = GEO_CLAUSE.findall(query.get('in', [''])[0]) + GEO_CLAUSE.findall(query['for'][0])
+    geographies = [geography for geography, _ in clauses]
+
+    units = list(itertools.product(*[codes(geography, value, scale) for geography, value in clauses]))
+    if not units:
+        return b''
+
+    values = unit_values(fields, geographies, units).astype(str)
+
+    rows = [fields + geographies]
+    rows.extend(list(row) + list(unit) for row, unit in zip(values.tolist(), units))
+    return json.dumps(rows).encode('utf-8')
+
+
+def definition(field):
+    '''
+    Builds the JSON body of a variable definition request
+    :param field: variable or geography name
+    :type field: str
+    :return: JSON body
+    :rtype: bytes
+    '''
+    predicate_type = 'fips-for' if field in WIDTHS else 'int'
+    return json.dumps({'name': field, 'predicateType': predicate_type}).encode('utf-8')
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    '''
+    Answers data and variable definition requests from the replay cache of
+    the server, generating responses on first request
+    '''
+
+    protocol_version = 'HTTP/1.1'
+
+    # headers and body are written separately, which Nagle's algorithm would
+    # delay by a round of delayed acknowledgements
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = self.server.replay.get(self.path)
+        if body is None:
+            url = urlsplit(self.path)
+            match = re.search(r'/variables/(.+)\.json$', url.path)
+            if match:
+                body = definition(requests.utils.unquote(match.group(1)))
+            else:
+                body = response(parse_qs(url.query), self.server.scale)
+            with self.server.lock:
+                self.server.replay[self.path] = body
+
+        self.send_response(200 if body else 204)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=0, scale=1.0, ready=None):
+    '''
+    Runs the stub server until the process is killed
+    :param port: port to listen on, 0 for any free port
+    :type port: int
+    :param scale: multiplier of SIZES
+    :type scale: float
+    :param ready: queue receiving the port once the server listens
+    :type ready: multiprocessing.Queue
+    :return: None
+    :rtype: None
+    '''
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+    server.daemon_threads = True
+    server.replay = {}
+    server.lock = threading.Lock()
+    server.scale = scale
+    if ready is not None:
+        ready.put(server.server_address[1])
+    server.serve_forever()
+
+
+def start(scale=1.0):
+    '''
+    Starts the stub server in a separate process, so that generating and
+    sending responses does not compete with the benchmarked code for the GIL
+    :param scale: multiplier of SIZES
+    :type scale: float
+    :return: the server process and its base URL
+    :rtype: tuple
+    '''
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve, args=(0, scale, ready), daemon=True)
+    process.start()
+    return process, 'http://127.0.0.1:%d' % ready.get(timeout=30)
+
+
+class StubAdapter(requests.adapters.HTTPAdapter):
+    '''
+    Transport adapter sending requests for the Census API to the stub server
+    '''
+
+    def __init__(self, base_url, **kwargs):
+        self.base_url = base_url
+        super(StubAdapter, self).__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        request.url = self.base_url + request.url[len(CENSUS_HOST):]
+        return super(StubAdapter, self).send(request, **kwargs)
+
+
+def install(reader, base_url):
+    '''
+    Routes the Census API requests of a reader to the stub server
+    :param reader: reader to redirect
+    :type reader: reader.CensusReader
+    :param base_url: base URL returned by start
+    :type base_url: str
+    :return: the reader
+    :rtype: reader.CensusReader
+    '''
+    adapter = StubAdapter(base_url, pool_connections=16, pool_maxsize=16)
+    reader.census_api.session.mount(CENSUS_HOST, adapter)
+    return reader
+
+
+if __name__ == '__main__':
+    serve(int(sys.argv[1]) if len(sys.argv) > 1 else 8000)
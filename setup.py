@@ -52,6 +52,9 @@ setup(
     # simple. Or you can use find_packages().
     packages=find_packages(exclude=['contrib', 'docs', 'tests']),
 
+    # Variable lookup tables read by the readers at run time
+    package_data={'us_census': ['api_variable_lookup/*.csv']},
+
     # Alternatively, if you want to distribute just a my_module.py, uncomment
     # this:
     #   py_modules=["my_module"],
@@ -60,5 +63,17 @@ setup(
     # your project is installed. For an analysis of "install_requires" vs pip's
     # requirements files see:
     # https://packaging.python.org/en/latest/requirements.html
-    install_requires=['census>=0.7', 'pandas>=0.18.0']
+    install_requires=['census>=0.7', 'pandas>=0.18.0'],
+
+    # Optional dependencies, installed with e.g. pip install us_census[parquet]
+    extras_require={
+        'parquet': ['pyarrow'],
+    },
+
+    # Command line tools installed with the package
+    entry_points={
+        'console_scripts': [
+            'us-census-export = us_census.cli:main',
+        ],
+    },
 )
@@ -0,0 +1,20 @@
+__author__ = 'linanqiu'
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+import stub_api
+
+
+@pytest.fixture(scope='session')
+def stub_url():
+    '''
+    Base URL of a local stub of the Census API, see benchmarks/stub_api.py
+    '''
+    process, base_url = stub_api.start(0.2)
+    yield base_url
+    process.terminate()
@@ -0,0 +1,147 @@
+__author__ = 'linanqiu'
+
+import asyncio
+import time
+
+import stub_api
+from us_census import aio, cache, population
+
+# Parameters of 100 variables, i.e. three chunk requests when not minimized
+PARAMS = {'sex': 'male', 'age': range(0, 100)}
+
+COUNTIES = {'state': 'OH', 'county': '*'}
+
+
+def async_reader(base_url, **kwargs):
+    return stub_api.install(aio.AsyncPopulationReader('test', cache=False, variable_cache=False, result_cache=False,
+                                                      minimize=False, **kwargs), base_url)
+
+
+def counters(reader):
+    '''
+    Collects the counters of every read of reader
+    '''
+    collected = []
+    reader.add_hook(lambda read_stats: collected.append(dict(read_stats.counters)))
+    return collected
+
+
+def test_token_bucket_below_one_per_second():
+    async def acquire():
+        await asyncio.wait_for(aio.TokenBucket(0.5).acquire(), timeout=1)
+
+    asyncio.run(acquire())
+
+
+def test_concurrent_reads_match_sync_reads(stub_url):
+    specs = [(COUNTIES, PARAMS), ({'state': 'OH'}, {'sex': 'female'}), ({'state': '*'}, {'race': 'asian'})]
+    reader = async_reader(stub_url, rate_limit=None)
+
+    async def read_all():
+        return await asyncio.gather(*(reader.read(geo, params) for geo, params in specs))
+
+    results = asyncio.run(read_all())
+
+    sync_reader = stub_api.install(population.PopulationReader('test', cache=False, variable_cache=False,
+                                                               result_cache=False, minimize=False), stub_url)
+    for result, (geo, params) in zip(results, specs):
+        assert result.equals(sync_reader.read(geo, params))
+
+
+def test_identical_reads_share_fetch(stub_url):
+    reader = async_reader(stub_url, rate_limit=None)
+    collected = counters(reader)
+
+    async def read_twice():
+        return await asyncio.gather(reader.read(COUNTIES, PARAMS), reader.read(COUNTIES, PARAMS))
+
+    first, second = asyncio.run(read_twice())
+
+    assert first.equals(second)
+    assert sum(read_counters.get('shared_fetches', 0) for read_counters in collected) == 1
+    assert sum(read_counters.get('requests', 0) for read_counters in collected) == 3
+
+
+def test_rate_limit(stub_url):
+    reader = async_reader(stub_url, rate_limit=20)
+    states = ['OH', 'PA', 'NY', 'CA', 'TX', 'FL', 'IL', 'MI', 'GA', 'NC', 'NJ', 'VA', 'WA', 'AZ', 'MA',
+              'TN', 'IN', 'MO', 'MD', 'WI', 'MN', 'CO', 'AL', 'SC', 'LA', 'KY', 'OR', 'OK', 'CT', 'IA']
+
+    async def read_states():
+        return await asyncio.gather(*(reader.read({'state': state}, {'sex': 'male'}) for state in states))
+
+    start = time.monotonic()
+    results = asyncio.run(read_states())
+    elapsed = time.monotonic() - start
+
+    # a burst of 20 requests, then 20 per second
+    assert all(len(result) == 1 for result in results)
+    assert elapsed >= (len(states) - 20) / 20.0 * 0.9
+
+
+def test_breakdown_matches_sync_read(stub_url):
+    reader = async_reader(stub_url, rate_limit=None)
+    params = {'sex': 'female', 'age': range(20, 25)}
+
+    result = asyncio.run(reader.read(COUNTIES, params, ['age']))
+
+    sync_reader = stub_api.install(population.PopulationReader('test', cache=False, variable_cache=False,
+                                                               result_cache=False, minimize=False), stub_url)
+    assert list(result.columns) == ['population', 'state', 'county', 'age']
+    assert result.equals(sync_reader.read(COUNTIES, params, ['age']))
+
+
+def test_iter_read_matches_sync_iter_read(stub_url):
+    reader = async_reader(stub_url, rate_limit=None)
+    geo = {'state': ['OH', 'PA'], 'county': '*', 'tract': '*'}
+
+    async def collect():
+        return [batch async for batch in reader.iter_read(geo, PARAMS, by_county=True, batch_size=50)]
+
+    batches = asyncio.run(collect())
+
+    sync_reader = stub_api.install(population.PopulationReader('test', cache=False, variable_cache=False,
+                                                               result_cache=False, minimize=False), stub_url)
+    expected = list(sync_reader.iter_read(geo, PARAMS, by_county=True, batch_size=50))
+    assert len(batches) == len(expected)
+    assert all(batch.equals(other) for batch, other in zip(batches, expected))
+
+
+def test_export_matches_sync_export(stub_url, tmp_path):
+    import pandas
+
+    reader = async_reader(stub_url, rate_limit=None)
+    geo = {'state': ['OH', 'PA'], 'county': '*'}
+
+    written = asyncio.run(reader.export(str(tmp_path / 'async'), geo, PARAMS))
+
+    sync_reader = stub_api.install(population.PopulationReader('test', cache=False, variable_cache=False,
+                                                               result_cache=False, minimize=False), stub_url)
+    assert sorted(written) == sorted(sync_reader.export(str(tmp_path / 'sync'), geo, PARAMS))
+
+    def load(name):
+        return pandas.read_parquet(str(tmp_path / name)).sort_values(['state', 'county']).reset_index(drop=True)
+
+    assert load('async').equals(load('sync'))
+
+
+def test_construction_is_lazy():
+    reader = aio.AsyncPopulationReader('test')
+
+    assert reader.census_client is None and reader.lookup_table is None
+    reader.close()
+
+
+def test_response_cache_read_off_loop(stub_url, tmp_path):
+    def cached_reader():
+        reader = async_reader(stub_url, rate_limit=None)
+        reader.cache = cache.ResponseCache(str(tmp_path))
+        return reader
+
+    first = asyncio.run(cached_reader().read(COUNTIES, PARAMS))
+    reader = cached_reader()
+    collected = counters(reader)
+    second = asyncio.run(reader.read(COUNTIES, PARAMS))
+
+    assert first.equals(second)
+    assert collected[0].get('cache_hits') == 1 and 'requests' not in collected[0]
@@ -0,0 +1,165 @@
+__author__ = 'linanqiu'
+
+import os
+import time
+
+import pandas
+
+import stub_api
+from us_census import cache, population
+
+COUNTIES = {'state': 'OH', 'county': '*'}
+
+
+class EvictingCache(cache.VariableCache):
+    '''
+    Variable cache evicted by another thread right after every add
+    '''
+
+    def add(self, key, dataframe, symbols):
+        cache.VariableCache.add(self, key, dataframe, symbols)
+        self.clear()
+
+
+def test_get_missing_symbols():
+    variable_cache = cache.VariableCache()
+    frame = pandas.DataFrame({'state': ['39'], 'P001': [1.0]})
+    variable_cache.add(('2010/sf1', ('state', '39')), frame, ['P001'])
+
+    assert variable_cache.get(('2010/sf1', ('state', '39')), ['P001', 'P002']) is None
+    assert variable_cache.get(('2010/sf1', ('state', '42')), ['P001']) is None
+    assert variable_cache.get(('2010/sf1', ('state', '39')), ['P001']).equals(frame)
+
+
+def test_read_after_eviction(stub_url):
+    def reader(variable_cache):
+        return stub_api.install(population.PopulationReader('test', cache=False, variable_cache=variable_cache,
+                                                            result_cache=False), stub_url)
+
+    params = {'sex': 'male', 'age': range(20, 25)}
+    result = reader(EvictingCache()).read(COUNTIES, params)
+
+    assert not result.empty
+    assert result.equals(reader(False).read(COUNTIES, params))
+
+
+def test_variable_cache_roll_up():
+    variable_cache = cache.VariableCache()
+    tracts = pandas.DataFrame({'P001': [1.0, 2.0, 4.0, 8.0], 'state': ['39', '39', '39', '42'],
+                               'county': ['001', '001', '003', '001'],
+                               'tract': ['000100', '000200', '000100', '000100']})
+    variable_cache.add(variable_cache.key('2010/sf1', {'state': '*', 'county': '*', 'tract': '*'}), tracts, ['P001'])
+
+    key = variable_cache.key('2010/sf1', {'state': 'OH', 'county': '*'})
+    assert variable_cache.roll_up(key, ['P001', 'P002']) == ['P002']
+    assert variable_cache.get(key, ['P001']).to_dict('list') == \
+        {'state': ['39', '39'], 'county': ['001', '003'], 'P001': [3.0, 4.0]}
+
+    # other datasets and filters that do not cover the units are not summed
+    assert variable_cache.roll_up(variable_cache.key('2010/sf2', {'state': 'OH'}), ['P001']) == ['P001']
+    assert variable_cache.roll_up(variable_cache.key('2010/sf1', {'state': 'OH', 'county': '001', 'tract': '*'}),
+                                  ['P001']) == ['P001']
+
+
+def result_frame(rows):
+    return pandas.DataFrame({'population': list(range(rows)), 'state': ['OH'] * rows})
+
+
+def test_result_keys_are_canonical():
+    result_cache = cache.ResultCache()
+
+    assert result_cache.key('2010/sf1', 'population', {'state': 'OH', 'county': 35}, {'age': range(20, 23)}) == \
+        result_cache.key('2010/sf1', 'population', {'county': '035', 'state': '39'}, {'age': [22, 21, 20]})
+    assert result_cache.key('2010/sf1', 'population', COUNTIES, {'sex': 'male'}) == \
+        result_cache.key('2010/sf1', 'population', COUNTIES, {'sex': ['male']})
+    assert result_cache.key('2010/sf1', 'population', COUNTIES, {'sex': 'male'}) != \
+        result_cache.key('2010/sf1', 'population', COUNTIES, {'sex': 'male'}, ['age'])
+
+
+def test_results_are_copied_in_and_out():
+    result_cache = cache.ResultCache()
+    result = result_frame(3)
+    result_cache.add('read', result)
+
+    result['population'] = 0
+    cached = result_cache.get('read')
+    assert cached['population'].tolist() == [0, 1, 2]
+
+    cached['population'] = 0
+    assert result_cache.get('read')['population'].tolist() == [0, 1, 2]
+
+
+def test_results_evicted_by_count():
+    result_cache = cache.ResultCache(max_entries=2)
+    result_cache.add('first', result_frame(1))
+    result_cache.add('second', result_frame(1))
+    result_cache.get('first')
+    result_cache.add('third', result_frame(1))
+
+    assert result_cache.get('second') is None
+    assert result_cache.get('first') is not None and result_cache.get('third') is not None
+
+
+def test_results_evicted_by_size():
+    size = int(result_frame(100).memory_usage(index=True, deep=True).sum())
+    result_cache = cache.ResultCache(max_bytes=2 * size)
+    result_cache.add('first', result_frame(100))
+    result_cache.add('second', result_frame(100))
+    result_cache.add('third', result_frame(100))
+
+    assert result_cache.get('first') is None
+    assert result_cache.bytes == 2 * size
+
+    # results larger than the whole cache are not stored
+    result_cache.add('large', result_frame(300))
+    assert result_cache.get('large') is None and result_cache.get('third') is not None
+
+
+def test_result_counters():
+    result_cache = cache.ResultCache()
+    result_cache.get('read')
+    result_cache.add('read', result_frame(1))
+    result_cache.get('read')
+    result_cache.get('read')
+
+    assert (result_cache.hits, result_cache.misses) == (2, 1)
+
+
+def test_response_round_trip(tmp_path):
+    response_cache = cache.ResponseCache(str(tmp_path))
+    response = pandas.DataFrame({'P001': [1.0, 2.5], 'P002': [3, 4], 'state': ['39', '39'], 'county': ['001', '035']})
+    key = response_cache.key('2010/sf1', ['P001', 'P002'], COUNTIES)
+    response_cache.set(key, response)
+
+    stored = response_cache.get(key)
+    assert stored.equals(response)
+    assert stored['county'].tolist() == ['001', '035']
+    assert key == response_cache.key('2010/sf1', ['P002', 'P001'], {'county': '*', 'state': 'oh'})
+
+
+def test_response_ttl(tmp_path):
+    response_cache = cache.ResponseCache(str(tmp_path), ttl=60)
+    response_cache.set('fresh', result_frame(1))
+    response_cache.set('stale', result_frame(1))
+    modified = time.time() - 120
+    os.utime(response_cache.path('stale'), (modified, modified))
+
+    assert response_cache.get('fresh') is not None
+    assert response_cache.get('stale') is None
+    assert not os.path.exists(response_cache.path('stale'))
+
+
+def test_response_lru_eviction(tmp_path):
+    response_cache = cache.ResponseCache(str(tmp_path))
+    now = time.time()
+    for age, key in enumerate(['third', 'second', 'first']):
+        response_cache.set(key, result_frame(10))
+        os.utime(response_cache.path(key), (now - 100 * (age + 1), now))
+
+    # reading the oldest response makes it the most recently used
+    response_cache.get('first')
+    response_cache.max_bytes = 2 * os.path.getsize(response_cache.path('first'))
+    response_cache.evict()
+
+    assert response_cache.get('second') is None
+    assert response_cache.get('first') is not None and response_cache.get('third') is not None
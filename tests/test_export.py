@@ -0,0 +1,88 @@
+__author__ = 'linanqiu'
+
+import os
+
+import pandas
+import pytest
+
+import stub_api
+from us_census import cli, export, population
+
+pytest.importorskip('pyarrow')
+
+GEO = {'state': ['OH', 'PA'], 'county': '*'}
+
+PARAMS = {'sex': 'male', 'age': range(20, 25)}
+
+
+def stub_reader(stub_url):
+    return stub_api.install(population.PopulationReader('test', cache=False, variable_cache=False,
+                                                        result_cache=False), stub_url)
+
+
+def load(path):
+    return pandas.read_parquet(path).sort_values(['state', 'county']).reset_index(drop=True)
+
+
+def part_files(path):
+    return sorted(os.path.relpath(os.path.join(root, name), path)
+                  for root, _, names in os.walk(path) for name in names if name != export.MANIFEST_NAME)
+
+
+def test_resume_skips_completed_partitions(stub_url, tmp_path):
+    reader = stub_reader(stub_url)
+    path = str(tmp_path / 'dataset')
+
+    assert sorted(reader.export(path, GEO, PARAMS)) == ['state=OH', 'state=PA']
+    assert reader.export(path, {'county': '*', 'state': ['pa', 'oh']}, {'age': range(20, 25), 'sex': ['male']}) == []
+
+
+def test_other_params_start_over(stub_url, tmp_path):
+    reader = stub_reader(stub_url)
+    path = str(tmp_path / 'dataset')
+
+    reader.export(path, GEO, PARAMS)
+    assert sorted(reader.export(path, GEO, {'sex': 'female'})) == ['state=OH', 'state=PA']
+
+    reader.export(str(tmp_path / 'expected'), GEO, {'sex': 'female'})
+    assert load(path).equals(load(str(tmp_path / 'expected')))
+
+
+def test_other_partitioning_deletes_stale_parts(stub_url, tmp_path):
+    reader = stub_reader(stub_url)
+    path = str(tmp_path / 'dataset')
+
+    reader.export(path, GEO, PARAMS)
+    written = reader.export(path, GEO, PARAMS, by_county=True)
+
+    assert len(written) == len(part_files(path)) > 2
+    assert os.path.join('state=OH', 'part-0.parquet') not in part_files(path)
+    assert len(load(path)) == len(written)
+
+
+def test_temporary_files_are_skipped(stub_url, tmp_path):
+    reader = stub_reader(stub_url)
+    path = str(tmp_path / 'dataset')
+
+    reader.export(path, GEO, PARAMS, resume=False)
+    expected = load(path)
+    # an interrupted write
+    with open(os.path.join(path, 'state=OH', '.part-035.parquet.tmp'), 'w') as partial:
+        partial.write('partial')
+
+    assert load(path).equals(expected)
+
+
+def test_shards_of_other_job_are_deleted(tmp_path):
+    directory = str(tmp_path / 'output.csv.shards')
+    job = {'table': 'population', 'geo': [GEO], 'params': [{'sex': 'male'}], 'breakdown': None}
+
+    cli.start_shards(directory, cli.job_identity(job, 'csv'), resume=True)
+    open(cli.shard_path(directory, 0, 'csv'), 'w').close()
+
+    cli.start_shards(directory, cli.job_identity(dict(job, geo=[{'state': ['pa', 'oh'], 'county': '*'}]), 'csv'),
+                     resume=True)
+    assert os.path.exists(cli.shard_path(directory, 0, 'csv'))
+
+    cli.start_shards(directory, cli.job_identity(dict(job, params=[{'sex': 'female'}]), 'csv'), resume=True)
+    assert not os.path.exists(cli.shard_path(directory, 0, 'csv'))
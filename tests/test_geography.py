@@ -0,0 +1,51 @@
+__author__ = 'linanqiu'
+
+import pandas
+
+from us_census import geography
+
+TRACTS = {'state': '*', 'county': '*', 'tract': '*'}
+
+
+def tract_frame():
+    return pandas.DataFrame({
+        'P001': ['1', '2', '4', '8', '16'],
+        'P002': ['10', '20', '40', '80', '160'],
+        'state': ['39', '39', '39', '42', '42'],
+        'county': ['001', '001', '003', '001', '001'],
+        'tract': ['000100', '000200', '000100', '000100', '000200'],
+    })
+
+
+def test_covers():
+    assert geography.covers({'state': '39', 'county': '*'}, {'state': '39'})
+    assert geography.covers({'state': '*', 'county': '*'}, {'state': '39'})
+    assert geography.covers(TRACTS, {'state': '*', 'county': '*'})
+    assert geography.covers(TRACTS, {'state': '39', 'county': '003'})
+
+    # a single county does not partition its state, nor Ohio every state
+    assert not geography.covers({'state': '39', 'county': '035'}, {'state': '39'})
+    assert not geography.covers({'state': '39', 'county': '*'}, {'state': '*'})
+    assert not geography.covers({'state': '39', 'county': '*'}, {'state': '42'})
+    # same level, and tracts without their county
+    assert not geography.covers({'state': '*'}, {'state': '39'})
+    assert not geography.covers({'state': '*', 'tract': '*'}, {'state': '39'})
+
+
+def test_roll_up_selects_units():
+    result = geography.roll_up(tract_frame(), ['P001'], TRACTS, {'state': '39', 'county': '*'})
+    assert result.to_dict('list') == {'state': ['39', '39'], 'county': ['001', '003'], 'P001': [3.0, 4.0]}
+
+    result = geography.roll_up(tract_frame(), ['P001'], TRACTS, {'state': '42', 'county': '001'})
+    assert result.to_dict('list') == {'state': ['42'], 'county': ['001'], 'P001': [24.0]}
+
+
+def test_roll_up_tracts_to_counties_to_states():
+    counties = geography.roll_up(tract_frame(), ['P001', 'P002'], TRACTS, {'state': '*', 'county': '*'})
+    assert counties.to_dict('list') == {'state': ['39', '39', '42'], 'county': ['001', '003', '001'],
+                                        'P001': [3.0, 4.0, 24.0], 'P002': [30.0, 40.0, 240.0]}
+
+    states = geography.roll_up(counties, ['P001', 'P002'], {'state': '*', 'county': '*'}, {'state': '*'})
+    expected = {'state': ['39', '42'], 'P001': [7.0, 24.0], 'P002': [70.0, 240.0]}
+    assert states.to_dict('list') == expected
+    assert geography.roll_up(tract_frame(), ['P001', 'P002'], TRACTS, {'state': '*'}).to_dict('list') == expected
@@ -0,0 +1,77 @@
+__author__ = 'linanqiu'
+
+import random
+
+import numpy
+import pytest
+
+from us_census import household, population
+
+
+def consistent_values(reader):
+    '''
+    Synthetic values of every variable of a reader's table: random values for
+    the variables no other variable of their table refines, and for every
+    other variable the sum of the ones it generalizes
+    '''
+    index = reader.api_index
+    row_ids = reader.api_lookup['row_id'].tolist()
+
+    tables = {}
+    for position, row_id in enumerate(row_ids):
+        tables.setdefault(row_id[:-3], []).append(position)
+
+    state = random.Random(0)
+    values = numpy.zeros(len(row_ids))
+    for positions in tables.values():
+        leaves = [position for position in positions
+                  if not any(index.generalizes(index.keys[position], index.keys[other]) for other in positions)]
+        for position in leaves:
+            values[position] = state.randint(0, 1000)
+        for position in positions:
+            if position not in leaves:
+                values[position] = sum(values[leaf] for leaf in leaves
+                                       if index.generalizes(index.keys[position], index.keys[leaf]))
+    return dict(zip(row_ids, values))
+
+
+def random_params(reader, state):
+    params = {}
+    for dimension, values in reader.api_index.values.items():
+        if state.random() < 0.4:
+            continue
+        if dimension == 'age' and state.random() < 0.5:
+            start = state.randint(0, 102)
+            params[dimension] = range(start, state.randint(start + 1, 103))
+            continue
+        values = sorted(values, key=str)
+        params[dimension] = state.sample(values, state.randint(1, len(values)))
+    return params
+
+
+@pytest.mark.parametrize('reader_class', [population.PopulationReader, household.HouseholdReader])
+def test_minimized_totals_match(reader_class):
+    reader = reader_class('test')
+    values = consistent_values(reader)
+
+    state = random.Random(1)
+    for _ in range(500):
+        params = random_params(reader, state)
+        try:
+            selected = reader.filter_api_variable(params)['row_id'].tolist()
+        except NotImplementedError:
+            continue
+        symbols, weights = reader.resolve(params)
+
+        assert len(symbols) <= len(selected)
+        assert sum(values[symbol] * weight for symbol, weight in zip(symbols, weights)) == \
+            sum(values[symbol] for symbol in selected), params
+
+
+def test_minimized_examples():
+    reader = population.PopulationReader('test')
+
+    assert len(reader.resolve({'sex': 'male', 'age': range(0, 100)})[0]) == 4
+    assert reader.resolve({'sex': ['male', 'female'], 'age': range(0, 103)}) == (['PCT0120001'], [1])
+    assert len(population.PopulationReader('test', minimize=False).resolve({'sex': 'male', 'age': range(0, 100)})[0]) \
+        == 100
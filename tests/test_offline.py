@@ -0,0 +1,59 @@
+__author__ = 'linanqiu'
+
+import pytest
+
+import stub_api
+from us_census import offline, population
+
+PARAMS = {'sex': 'male', 'age': range(20, 25)}
+
+
+@pytest.fixture(scope='module')
+def store(stub_url, tmp_path_factory):
+    '''
+    Offline store holding the counties of Ohio and Pennsylvania and the state
+    level of Ohio only
+    '''
+    store = offline.OfflineStore(str(tmp_path_factory.mktemp('offline')))
+    reader = stub_api.install(population.PopulationReader('test', cache=False, variable_cache=False,
+                                                          result_cache=False), stub_url)
+    store.ingest(reader, {'state': 'OH', 'county': '*'})
+    store.ingest(reader, {'state': 'PA', 'county': '*'})
+    store.ingest(reader, {'state': 'OH'})
+    return store
+
+
+def offline_reader(store):
+    return population.PopulationReader('test', offline=store, variable_cache=False, result_cache=False)
+
+
+def test_uningested_units_raise(store):
+    reader = offline_reader(store)
+
+    with pytest.raises(NotImplementedError):
+        reader.read({'state': 'NY', 'county': '*'}, PARAMS)
+    with pytest.raises(NotImplementedError):
+        reader.read({'state': '*', 'county': '*'}, PARAMS)
+
+
+def test_ingested_level_answers_filter(store):
+    result = offline_reader(store).read({'state': 'PA', 'county': '*'}, PARAMS)
+
+    assert len(result) > 1 and set(result['state']) == {'PA'}
+
+
+def test_roll_up_from_counties(store):
+    reader = offline_reader(store)
+
+    # the state level holds Ohio only, so Pennsylvania is summed from its counties
+    state = reader.read({'state': 'PA'}, PARAMS)
+    counties = reader.read({'state': 'PA', 'county': '*'}, PARAMS)
+
+    assert list(state['state']) == ['PA']
+    assert state['population'][0] == counties['population'].sum()
+
+
+def test_ingested_level_preferred_to_roll_up(store):
+    assert store.answering('population', {'state': '39'}) == {'state': '39'}
+    assert store.answering('population', {'state': '42'}) == {'state': '42', 'county': '*'}
+    assert store.answering('population', {'state': '36'}) is None
@@ -0,0 +1,58 @@
+__author__ = 'linanqiu'
+
+import pandas
+import us.states
+
+from us_census import query
+from us_census.geography import state_fips_codes
+
+# 13 states, a quarter of them, enough to fetch every state at once
+STATES = ['OH', 'PA', 'NY', 'CA', 'TX', 'FL', 'IL', 'MI', 'GA', 'NC', 'NJ', 'VA', 'WA']
+
+
+def test_plan_targeted_and_wildcard_lists():
+    assert query.plan_geo({'state': 'OH', 'county': ['035', 49, '061']}) == \
+        [{'county': code, 'state': '39'} for code in ['035', '049', '061']]
+    assert query.plan_geo({'state': 'OH', 'county': [35, 49, 61, 93]}) == [{'county': '*', 'state': '39'}]
+    assert query.plan_geo({'state': STATES}) == [{'state': '*'}]
+    assert len(query.plan_geo({'state': STATES[:12]})) == 12
+
+
+def test_plan_crossed_lists():
+    plan = query.plan_geo({'state': ['oh', 42], 'county': ['035', '049']})
+
+    assert sorted((planned['state'], planned['county']) for planned in plan) == \
+        [('39', '035'), ('39', '049'), ('42', '035'), ('42', '049')]
+
+
+def test_plan_keeps_states_of_tracts():
+    plan = query.plan_geo({'state': STATES, 'county': '*', 'tract': '*'})
+    assert sorted(planned['state'] for planned in plan) == sorted(us.states.lookup(state).fips for state in STATES)
+    assert all(planned['county'] == '*' and planned['tract'] == '*' for planned in plan)
+
+    plan = query.plan_geo({'state': '*', 'county': ['001', '003', '005', '007'], 'subdivision': '*'})
+    assert [planned['state'] for planned in plan] == state_fips_codes()
+    assert all(planned['county'] == '*' for planned in plan)
+
+    # counties are served across every state
+    assert query.plan_geo({'state': '*', 'county': ['001', '003', '005', '007']}) == [{'county': '*', 'state': '*'}]
+    assert query.plan_geo({'state': STATES, 'county': '*'}) == [{'county': '*', 'state': '*'}]
+
+
+def test_select_units_pads_codes():
+    response = pandas.DataFrame({'P001': [1, 2, 3, 4], 'state': [39, 39, 42, 6], 'county': [35, 49, 35, 1]})
+
+    selected = query.select_units(response, {'state': ['OH', '06'], 'county': ['035', 1]})
+    assert selected.to_dict('list') == {'P001': [1, 4], 'state': [39, 6], 'county': [35, 1]}
+
+    response['state'] = response['state'].astype(float)
+    assert query.select_units(response, {'state': 'OH', 'county': [49]})['P001'].tolist() == [2]
+
+
+def test_select_units_of_tracts():
+    response = pandas.DataFrame({'P001': [1, 2, 3], 'state': ['39', '39', '42'], 'county': ['035', '049', '035'],
+                                 'tract': ['000100', '000100', '000200']})
+
+    selected = query.select_units(response, {'state': ['OH', 'PA'], 'county': ['035'], 'tract': '*'})
+    assert selected['P001'].tolist() == [1, 3]
+    assert query.select_units(pandas.DataFrame(), {'state': ['OH']}).empty
@@ -0,0 +1,57 @@
+__author__ = 'linanqiu'
+
+import time
+
+import pytest
+
+from us_census import retry
+
+
+def open_breaker(reset_timeout=0.05):
+    breaker = retry.CircuitBreaker(threshold=2, reset_timeout=reset_timeout)
+    breaker.record(False)
+    breaker.record(False)
+    return breaker
+
+
+def test_no_attempts_still_calls_once():
+    assert retry.Retrier(max_attempts=0).call(lambda: 'response') == 'response'
+
+
+def test_gives_up_after_attempts():
+    calls = []
+
+    def fail():
+        calls.append(None)
+        raise retry.TransientError(503)
+
+    with pytest.raises(retry.TransientError):
+        retry.Retrier(max_attempts=3, backoff=0).call(fail)
+    assert len(calls) == 3
+
+
+def test_breaker_lets_one_probe_through():
+    breaker = open_breaker()
+    with pytest.raises(retry.CircuitOpenError):
+        breaker.check()
+
+    time.sleep(0.06)
+    breaker.check()
+    with pytest.raises(retry.CircuitOpenError):
+        breaker.check()
+
+    breaker.record(True)
+    breaker.check()
+    breaker.check()
+
+
+def test_failed_probe_opens_breaker_again():
+    breaker = open_breaker()
+    time.sleep(0.06)
+    breaker.check()
+    breaker.record(False)
+
+    with pytest.raises(retry.CircuitOpenError):
+        breaker.check()
+    time.sleep(0.06)
+    breaker.check()
@@ -0,0 +1,560 @@
+__author__ = 'linanqiu'
+
+# Maximum number of Census API requests in flight at once, which is also the
+# size of the pooled keep-alive connections
+MAX_IN_FLIGHT = 16
+
+# Census API requests started per second, None for no limit
+RATE_LIMIT = 10
+
+import logging
+
+logger = logging.getLogger('AsyncReader')
+
+import asyncio
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas
+
+from . import cache as response_cache
+from . import export
+from . import household
+from . import population
+from . import query
+from . import reader
+from . import stats
+
+
+class TokenBucket():
+    '''
+    Token bucket limiting the rate at which requests are started, while
+    letting bursts of up to capacity requests through at once
+    '''
+
+    def __init__(self, rate=RATE_LIMIT, capacity=None):
+        '''
+        :param rate: tokens added per second
+        :type rate: float
+        :param capacity: maximum number of tokens held, defaults to rate and
+        to at least one token, so that rates below one per second still let
+        requests through
+        :type capacity: float
+        '''
+        if rate <= 0:
+            raise NotImplementedError('rate_limit must be a positive number of requests per second, or None')
+        self.rate = rate
+        self.capacity = max(1, capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        '''
+        Waits until a token is available and takes it. Waiters are served in
+        the order they arrive
+        :return: None
+        :rtype: None
+        '''
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AsyncReaderMixin():
+    '''
+    Awaitable read and read_many for CensusReader and its subclasses.
+    Chunk requests run on a bounded thread pool sharing pooled keep-alive
+    connections, and are started no faster than the token bucket allows
+    '''
+
+    def init_async(self, max_in_flight, rate_limit):
+        '''
+        Sets up the thread pool and rate limiter. The connection pool is
+        mounted on the census client when it is created, see census_api
+        :param max_in_flight: maximum number of requests in flight at once
+        :type max_in_flight: int
+        :param rate_limit: requests started per second, None for no limit
+        :type rate_limit: float
+        :return: None
+        :rtype: None
+        '''
+        self.max_in_flight = max_in_flight
+        self.rate_limit = rate_limit
+        self.loop = None
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        self.mounted_client = None
+
+    @property
+    def census_api(self):
+        '''
+        Client of the census module, created on first use with a pool of
+        max_in_flight keep-alive connections mounted on its session
+        :return: census client, e.g. census.core.SF1Client
+        :rtype: census.core.Client
+        '''
+        client = reader.CensusReader.census_api.fget(self)
+        with self.lock:
+            if self.mounted_client is not client:
+                import requests.adapters
+
+                adapter = requests.adapters.HTTPAdapter(pool_connections=self.max_in_flight,
+                                                        pool_maxsize=self.max_in_flight)
+                client.session.mount('https://', adapter)
+                client.session.mount('http://', adapter)
+                self.mounted_client = client
+        return client
+
+    @census_api.setter
+    def census_api(self, census_api):
+        self.census_client = census_api
+
+    def bind_loop(self):
+        '''
+        Creates the semaphore, token bucket and table of fetches in flight for
+        the running event loop, as asyncio primitives cannot be shared between
+        event loops
+        :return: None
+        :rtype: None
+        '''
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            self.semaphore = asyncio.Semaphore(self.max_in_flight)
+            self.bucket = TokenBucket(self.rate_limit) if self.rate_limit else None
+            self.pending = {}
+
+    async def load_lookup(self):
+        '''
+        Reads the variable lookup table on the thread pool if it is not loaded
+        yet, so that parsing it does not block the event loop
+        :return: None
+        :rtype: None
+        '''
+        if self.lookup_table is None:
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.read_api_lookup)
+
+    async def read(self, geo, params, breakdown=None, allow_partial=False):
+        '''
+        Awaitable version of read
+        :param geo: geography filters. e.g. {'state': 'OH', 'county': '*'}
+        :type geo: dict
+        :param params: parameters as taken by read
+        :type params: dict
+        :param breakdown: dimensions to break the total down by, as in read
+        :type breakdown: list[str]
+        :param allow_partial: return the geographies whose requests succeeded, as in read
+        :type allow_partial: bool
+        :return: DataFrame of results from query
+        :rtype: pandas.DataFrame
+        '''
+        self.bind_loop()
+        read_stats = stats.ReadStats(self.table, geo, params)
+        with stats.activate(read_stats), read_stats.timer('total'):
+            failures = [] if allow_partial else None
+            key, result = self.recall(geo, params, breakdown)
+            if result is None:
+                result = await self.compute(geo, params, breakdown, failures)
+                self.remember(key, result, failures)
+            if allow_partial:
+                result.attrs['failures'] = failures
+
+        read_stats.increment('rows', len(result))
+        stats.run_hooks(self.hooks, read_stats)
+        return result
+
+    async def compute(self, geo, params, breakdown=None, failures=None):
+        '''
+        Awaitable version of compute
+        :param geo: geography filters, as taken by read
+        :type geo: dict
+        :param params: parameters, as taken by read
+        :type params: dict
+        :param breakdown: dimensions to break the total down by, as taken by read
+        :type breakdown: list[str]
+        :param failures: list receiving the failed requests, or None to raise on failure
+        :type failures: list
+        :return: DataFrame of results from query
+        :rtype: pandas.DataFrame
+        '''
+        await self.load_lookup()
+        # variables are resolved without awaiting, so concurrent reads on the
+        # event loop do not interleave
+        if breakdown:
+            api_variables = self.filter_api_variable(self.breakdown_params(params, breakdown))
+            symbols = api_variables['row_id'].tolist()
+        else:
+            symbols, weights = self.resolve(params)
+        stats.increment('variables', len(symbols))
+
+        with stats.timer('query'):
+            dataframe = await self.query_partial(symbols, geo, failures)
+
+        if breakdown:
+            return self.aggregate_breakdown(dataframe, api_variables, breakdown, geo)
+        return self.aggregate(dataframe, symbols, geo, weights)
+
+    async def read_many(self, specs, allow_partial=False):
+        '''
+        Awaitable version of read_many. Geographies are queried concurrently
+        :param specs: list of (geo, params) pairs, each as taken by read
+        :type specs: list[tuple]
+        :param allow_partial: return the geographies whose requests succeeded, as in read
+        :type allow_partial: bool
+        :return: one DataFrame of results per spec, in the order of specs
+        :rtype: list[pandas.DataFrame]
+        '''
+        self.bind_loop()
+        await self.load_lookup()
+        read_stats = stats.ReadStats(self.table)
+        with stats.activate(read_stats), read_stats.timer('total'):
+            results = [None] * len(specs)
+            keys = [None] * len(specs)
+
+            groups = OrderedDict()
+            for index, (geo, params) in enumerate(specs):
+                keys[index], results[index] = self.recall(geo, params)
+                if results[index] is not None:
+                    if allow_partial:
+                        results[index].attrs['failures'] = []
+                    continue
+                key = tuple(response_cache.normalize_geo(geo))
+                groups.setdefault(key, (geo, []))[1].append((index,) + self.resolve(params))
+
+            async def read_group(geo, members):
+                union = list(OrderedDict.fromkeys(symbol for _, symbols, _ in members for symbol in symbols))
+                read_stats.increment('variables', len(union))
+                failures = [] if allow_partial else None
+                with read_stats.timer('query'):
+                    dataframe = await self.query_partial(union, geo, failures)
+                for index, symbols, weights in members:
+                    results[index] = self.aggregate(dataframe, symbols, geo, weights)
+                    self.remember(keys[index], results[index], failures)
+                    if allow_partial:
+                        results[index].attrs['failures'] = failures
+
+            await asyncio.gather(*(read_group(geo, members) for geo, members in groups.values()))
+
+        read_stats.increment('rows', sum(len(result) for result in results))
+        stats.run_hooks(self.hooks, read_stats)
+        return results
+
+    async def partitions(self, geo, by_county=False):
+        '''
+        Awaitable version of export.partitions
+        :param geo: geography filters. e.g. {'state': '*', 'county': '*', 'tract': '*'}
+        :type geo: dict
+        :param by_county: split each state into its counties
+        :type by_county: bool
+        :return: list of (partition name, geography filters) pairs
+        :rtype: list[tuple]
+        '''
+        if 'state' not in geo:
+            return [('all', geo)]
+
+        result = []
+        for name, state_geo in export.state_partitions(geo):
+            if not by_county or geo.get('county') != '*':
+                result.append((name, state_geo))
+                continue
+
+            counties = await self.fetch_census([export.total_symbol(self)], {'state': state_geo['state'], 'county': '*'})
+            result.extend(export.county_partitions(name, state_geo, counties))
+        return result
+
+    async def iter_read(self, geo, params, breakdown=None, by_county=False, batch_size=export.BATCH_SIZE):
+        '''
+        Asynchronous generator version of iter_read, used with async for
+        :param geo: geography filters. e.g. {'state': '*', 'county': '*', 'tract': '*'}
+        :type geo: dict
+        :param params: parameters as taken by read
+        :type params: dict
+        :param breakdown: dimensions to break totals down by, as taken by read
+        :type breakdown: list[str]
+        :param by_county: split each state into its counties
+        :type by_county: bool
+        :param batch_size: maximum number of rows per DataFrame
+        :type batch_size: int
+        :return: asynchronous generator of DataFrames with the columns of read
+        :rtype: async_generator
+        '''
+        self.bind_loop()
+        await self.load_lookup()
+        plan = export.BatchPlan(self, params, breakdown, batch_size)
+
+        for name, part_geo in await self.partitions(geo, by_county):
+            logger.info('Reading partition %s' % name)
+            # bypass the in-memory variable cache so partitions are not retained
+            dataframe = await self.fetch_census(plan.symbols, part_geo)
+            for batch in plan.batches(dataframe, part_geo):
+                yield batch
+            del dataframe
+
+    async def export(self, path, geo, params, by_county=False, max_workers=export.MAX_WORKERS, resume=True):
+        '''
+        Awaitable version of export. Up to max_workers partitions are fetched
+        concurrently on the event loop
+        :param path: directory of the dataset
+        :type path: str
+        :param geo: geography filters. e.g. {'state': '*', 'county': '*', 'tract': '*'}
+        :type geo: dict
+        :param params: parameters as taken by read
+        :type params: dict
+        :param by_county: split each state into its counties
+        :type by_county: bool
+        :param max_workers: number of partitions fetched at the same time
+        :type max_workers: int
+        :param resume: skip the partitions already written by an earlier call of the same export
+        :type resume: bool
+        :return: names of the partitions written by this call
+        :rtype: list[str]
+        '''
+        self.bind_loop()
+        await self.load_lookup()
+        job = export.job_identity(self, geo, params, by_county)
+        completed = export.start_export(path, geo, job, resume)
+        symbols, weights = self.resolve(params)
+
+        todo = [(name, part_geo) for name, part_geo in await self.partitions(geo, by_county)
+                if name not in completed]
+        logger.info('Exporting %d partitions, %d already completed' % (len(todo), len(completed)))
+
+        semaphore = asyncio.Semaphore(max_workers)
+
+        async def read_partition(name, part_geo):
+            async with semaphore:
+                try:
+                    # bypass the in-memory variable cache so partitions are not retained
+                    dataframe = await self.fetch_census(symbols, part_geo)
+                    return name, self.aggregate(dataframe, symbols, part_geo, weights)
+                except Exception as e:
+                    logger.warning('Partition %s failed: %s' % (name, e))
+                    return name, None
+
+        written = []
+        failed = []
+        for future in asyncio.as_completed([read_partition(name, part_geo) for name, part_geo in todo]):
+            name, dataframe = await future
+            if dataframe is None:
+                failed.append(name)
+                continue
+
+            export.record_partition(dataframe, path, job, name, completed)
+            written.append(name)
+            logger.info('Wrote partition %s (%d of %d)' % (name, len(written), len(todo)))
+
+        export.check_failed(failed)
+        return written
+
+    async def query_partial(self, symbols, geo, failures=None):
+        '''
+        Awaitable version of query_partial
+        :param symbols: variables to query
+        :type symbols: list[str]
+        :param geo: geography filters
+        :type geo: dict
+        :param failures: list receiving a report per failed request, or None
+        :type failures: list
+        :return: one row per geography whose request succeeded
+        :rtype: pandas.DataFrame
+        '''
+        if failures is None:
+            return await self.query_census(symbols, geo)
+        return await self.query_planned(self.query_census, symbols, geo, failures)
+
+    async def query_census(self, symbols, geo):
+        '''
+        Awaitable version of query_census
+        :param symbols: variables to query
+        :type symbols: list[str]
+        :param geo: geography filters
+        :type geo: dict
+        :return: one row per geography, with geography and variable columns
+        :rtype: pandas.DataFrame
+        '''
+        if query.has_lists(geo):
+            return await self.query_planned(self.query_census, symbols, geo)
+
+        if self.variable_cache is None:
+            return await self.fetch_census(symbols, geo)
+
+        key = self.variable_cache.key(self.spec.census_dataset, geo)
+        missing = self.variable_cache.missing(key, symbols)
+        stats.increment('variables_cached', len(symbols) - len(missing))
+        if missing:
+            unanswered = self.variable_cache.roll_up(key, missing)
+            stats.increment('variables_rolled_up', len(missing) - len(unanswered))
+            missing = unanswered
+        if missing:
+            stats.increment('variables_fetched', len(missing))
+            fetched = await self.fetch_census(missing, geo)
+            if fetched.empty:
+                return fetched
+            self.variable_cache.add(key, fetched, missing)
+
+        dataframe = self.variable_cache.get(key, symbols)
+        if dataframe is None:
+            # evicted since they were counted or added, see CensusReader.query_census
+            stats.increment('variables_fetched', len(symbols))
+            dataframe = await self.fetch_census(symbols, geo)
+        return dataframe
+
+    async def query_planned(self, query_function, symbols, geo, failures=None):
+        '''
+        Awaitable version of query.query_planned. Planned requests run
+        concurrently on the event loop
+        :param query_function: coroutine function taking variables and
+        geography filters without lists
+        :type query_function: callable
+        :param symbols: variables to query
+        :type symbols: list[str]
+        :param geo: geography filters with lists of codes
+        :type geo: dict
+        :param failures: list receiving a report per failed request, or None to raise the first failure
+        :type failures: list
+        :return: one row per listed geography, with geography and variable columns
+        :rtype: pandas.DataFrame
+        '''
+        plan = query.plan_geo(geo)
+        frames = await asyncio.gather(*(query_function(symbols, planned_geo) for planned_geo in plan),
+                                      return_exceptions=failures is not None)
+        for i, (planned_geo, frame) in enumerate(zip(plan, frames)):
+            if isinstance(frame, Exception):
+                failures.append(query.failure(planned_geo, symbols, frame))
+                frames[i] = pandas.DataFrame()
+        return query.select_units(query.concat_units(frames), geo)
+
+    async def fetch_census(self, symbols, geo):
+        '''
+        Awaitable version of fetch_census. Concurrent reads on the event loop
+        fetching the same variables for the same geography await one task
+        :param symbols: variables to fetch
+        :type symbols: list[str]
+        :param geo: geography filters
+        :type geo: dict
+        :return: one row per geography, with geography and variable columns,
+        to be treated as read-only since it may be shared
+        :rtype: pandas.DataFrame
+        '''
+        if query.has_lists(geo):
+            return await self.query_planned(self.fetch_census, symbols, geo)
+
+        if self.offline is not None:
+            stats.increment('offline_reads')
+            return self.offline.query(self.table, symbols, geo)
+
+        key = query.flight_key(self.spec.census_dataset, symbols, geo)
+        task = self.pending.get(key)
+        if task is None:
+            task = self.pending[key] = asyncio.ensure_future(self.fetch_response(symbols, geo))
+            task.add_done_callback(lambda done: self.pending.pop(key) if self.pending.get(key) is done else None)
+        else:
+            stats.increment('shared_fetches')
+
+        # a cancelled caller must not cancel the fetch awaited by the others
+        return await asyncio.shield(task)
+
+    async def fetch_response(self, symbols, geo):
+        '''
+        Awaitable version of fetch_response. All chunks are scheduled at once
+        and throttled by the semaphore and token bucket
+        :param symbols: variables to fetch
+        :type symbols: list[str]
+        :param geo: geography filters
+        :type geo: dict
+        :return: one row per geography, with geography and variable columns
+        :rtype: pandas.DataFrame
+        '''
+        # the disk cache is read and written on the thread pool, off the event loop
+        loop = asyncio.get_running_loop()
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(self.spec.census_dataset, symbols, geo)
+            dataframe = await loop.run_in_executor(self.executor, self.cache.get, key)
+            if dataframe is not None:
+                logger.info('Read response from cache ' + key)
+                stats.increment('cache_hits')
+                return dataframe
+            stats.increment('cache_misses')
+
+        chunks = query.chunk_symbols(symbols)
+        frames = await asyncio.gather(*(self.fetch_chunk(chunk, geo) for chunk in chunks))
+        with stats.timer('frame'):
+            dataframe = query.merge_chunks(frames, chunks)
+
+        if key is not None and not dataframe.empty:
+            await loop.run_in_executor(self.executor, self.cache.set, key, dataframe)
+
+        return dataframe
+
+    async def fetch_chunk(self, symbols, geo):
+        '''
+        Fetches one chunk of variables, retrying transient failures with
+        self.retrier
+        :param symbols: at most query.MAX_VARIABLES variables
+        :type symbols: list[str]
+        :param geo: geography filters
+        :type geo: dict
+        :return: response of the chunk
+        :rtype: pandas.DataFrame
+        '''
+        try:
+            return await self.retrier.call_async(self.request_chunk, symbols, geo)
+        except Exception as error:
+            raise query.ChunkError(symbols, error) from error
+
+    async def request_chunk(self, symbols, geo):
+        '''
+        Sends the request of one chunk once the rate limit allows
+        :param symbols: at most query.MAX_VARIABLES variables
+        :type symbols: list[str]
+        :param geo: geography filters
+        :type geo: dict
+        :return: response of the chunk
+        :rtype: pandas.DataFrame
+        '''
+        async with self.semaphore:
+            if self.bucket is not None:
+                await self.bucket.acquire()
+            loop = asyncio.get_running_loop()
+            with stats.timer('request'):
+                return await loop.run_in_executor(self.executor, stats.bind(self.query_census_chunk), symbols, geo)
+
+    def close(self):
+        '''
+        Shuts down the thread pool and closes pooled connections
+        :return: None
+        :rtype: None
+        '''
+        self.executor.shutdown(wait=False)
+        if self.census_client is not None:
+            self.census_client.session.close()
+
+
+class AsyncCensusReader(AsyncReaderMixin, reader.CensusReader):
+    '''
+    Reader for any registered table with awaitable reads
+    '''
+
+    def __init__(self, CENSUS_API_KEY, max_in_flight=MAX_IN_FLIGHT, rate_limit=RATE_LIMIT, **kwargs):
+        reader.CensusReader.__init__(self, CENSUS_API_KEY, **kwargs)
+        self.init_async(max_in_flight, rate_limit)
+
+
+class AsyncPopulationReader(AsyncCensusReader, population.PopulationReader):
+    '''
+    Reader for getting population data from US census with awaitable reads
+    '''
+
+
+class AsyncHouseholdReader(AsyncCensusReader, household.HouseholdReader):
+    '''
+    Reader for reading household data from US Census with awaitable reads
+    '''
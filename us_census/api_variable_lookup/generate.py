@@ -0,0 +1,240 @@
+__author__ = 'linanqiu'
+
+import os
+
+# Variable definitions of the 2010 SF1, from which every lookup table is built
+XML_URL = 'http://api.census.gov/data/2010/sf1/variables.xml'
+
+# Attribute holding the variable name of each element of variables.xml
+XML_ID = '{http://www.w3.org/XML/1998/namespace}id'
+
+# Races in the order they are matched against a table's concept
+RACES = [
+    ('white', 'white'),
+    ('black', 'black'),
+    ('indian', 'indian_alaskan'),
+    ('asian', 'asian'),
+    ('hawaii', 'hawaii_pacific'),
+    ('other', 'other_alone'),
+    ('two', 'two_or_more'),
+]
+
+import logging
+
+logger = logging.getLogger('LookupGenerator')
+
+import hashlib
+import importlib
+import shutil
+import tempfile
+import urllib.request
+import xml.etree.ElementTree as ET
+
+
+def download(url=XML_URL):
+    '''
+    Downloads variables.xml to a temporary file, streaming it to disk
+    :param url: URL of variables.xml
+    :type url: str
+    :return: path of the downloaded file, to be deleted by the caller
+    :rtype: str
+    '''
+    handle, path = tempfile.mkstemp(suffix='.xml')
+    with os.fdopen(handle, 'wb') as xml_file, urllib.request.urlopen(url) as response:
+        shutil.copyfileobj(response, xml_file)
+    return path
+
+
+def file_hash(path):
+    '''
+    :param path: path of a file
+    :type path: str
+    :return: sha1 of the file's content
+    :rtype: str
+    '''
+    digest = hashlib.sha1()
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_variables(source, prefixes):
+    '''
+    Stream-parses variables.xml once, keeping the variables of the given
+    tables and discarding every other element as soon as it is read
+    :param source: path or file object of variables.xml
+    :type source: str
+    :param prefixes: prefixes of the tables' variables, e.g. ['PCT012', 'P038']
+    :type prefixes: list[str]
+    :return: prefix to rows of (row_id, row_label, row_concept)
+    :rtype: dict
+    '''
+    prefixes = tuple(prefixes)
+    rows = {prefix: [] for prefix in prefixes}
+
+    for _, element in ET.iterparse(source, events=('end',)):
+        row_id = element.attrib.get(XML_ID)
+        if row_id is not None and row_id.startswith(prefixes):
+            for prefix in prefixes:
+                if row_id.startswith(prefix):
+                    rows[prefix].append((row_id, element.attrib['label'], element.attrib.get('concept')))
+        if row_id is not None:
+            element.clear()
+
+    return rows
+
+
+def match(strings, patterns, default=None):
+    '''
+    Maps each string to the value of the first pattern it contains
+    :param strings: lower case strings
+    :type strings: pandas.Series
+    :param patterns: (substring, value) pairs in order of precedence
+    :type patterns: list[tuple]
+    :param default: value of strings containing no pattern
+    :type default: object
+    :return: matched values
+    :rtype: numpy.ndarray
+    '''
+    import numpy
+
+    conditions = [strings.str.contains(pattern, regex=False).to_numpy() for pattern, _ in patterns]
+    choices = [numpy.full(len(strings), value, dtype=object) for _, value in patterns]
+    return numpy.select(conditions, choices, default=default)
+
+
+def classify_race(dataframe):
+    '''
+    Adds the race and hispanic_latino_origin columns, shared by every table,
+    from the concept of each variable
+    :param dataframe: variables with row_label and row_concept columns
+    :type dataframe: pandas.DataFrame
+    :return: None
+    :rtype: None
+    '''
+    concept = dataframe['row_concept'].fillna('').str.lower()
+    dataframe['race'] = match(concept, RACES)
+    dataframe['hispanic_latino_origin'] = match(concept, [('(hispanic or latino)', True),
+                                                          ('not hispanic or latino', False)])
+
+
+def classify_population(dataframe):
+    '''
+    Adds the dimension columns of table PCT12 (sex by age), whose variables
+    are numbered 1 for the total, 2 to 105 for males and 106 to 209 for
+    females, each sex starting with its total
+    :param dataframe: variables with row_label and row_concept columns
+    :type dataframe: pandas.DataFrame
+    :return: None
+    :rtype: None
+    '''
+    import numpy
+
+    suffix = dataframe.index.str[-3:].astype(int).to_numpy()
+
+    dataframe['sex'] = numpy.where(suffix == 1, None, numpy.where(suffix <= 105, 'male', 'female').astype(object))
+    dataframe['age'] = numpy.select([suffix <= 2, suffix <= 105, suffix == 106, suffix <= 209],
+                                    [numpy.nan, suffix - 3, numpy.nan, suffix - 107], default=numpy.nan)
+    classify_race(dataframe)
+
+
+def classify_household(dataframe):
+    '''
+    Adds the dimension columns of table P38 (family type by presence and age
+    of own children) from the label of each variable
+    :param dataframe: variables with row_label and row_concept columns
+    :type dataframe: pandas.DataFrame
+    :return: None
+    :rtype: None
+    '''
+    label = dataframe['row_label'].str.lower()
+    dataframe['type'] = match(label, [('husband-wife', 'husband_wife'), ('female householder', 'female_householder'),
+                                      ('male householder', 'male_householder')])
+    dataframe['has_children'] = match(label, [('with own children', True), ('no own children', False)])
+    dataframe['children_age'] = match(label, [('under 6 years only', 'under_6'),
+                                              ('under 6 years and', 'under_6_and_6_to_17'),
+                                              ('6 to 17 years only', '6_to_17')])
+    classify_race(dataframe)
+
+
+def stamp_path(path):
+    return path + '.sha1'
+
+
+def is_current(path, source_hash):
+    '''
+    Checks whether a lookup csv was generated from the same variables.xml
+    :param path: path of the lookup csv
+    :type path: str
+    :param source_hash: sha1 of variables.xml
+    :type source_hash: str
+    :return: whether the csv is up to date
+    :rtype: bool
+    '''
+    try:
+        with open(stamp_path(path)) as stamp:
+            return os.path.exists(path) and stamp.read().strip() == source_hash
+    except OSError:
+        return False
+
+
+def create_lookups(specs=None, source=None, paths=None, force=False):
+    '''
+    Generates the lookup csvs of several tables in one pass over
+    variables.xml. Tables whose csv was generated from an identical
+    variables.xml are skipped
+    :param specs: tables to generate, defaults to every registered table with a classifier
+    :type specs: list[tables.TableSpec]
+    :param source: path of a local variables.xml, downloaded from XML_URL if None
+    :type source: str
+    :param paths: table name to csv path, overriding the specs' lookup_path
+    :type paths: dict
+    :param force: regenerate even if the csvs are up to date
+    :type force: bool
+    :return: paths of the csvs written
+    :rtype: list[str]
+    '''
+    import pandas
+
+    from .. import tables
+
+    if specs is None:
+        specs = [spec for spec in tables.TABLES.values() if spec.classifier is not None]
+    paths = dict((spec.name, spec.lookup_path) for spec in specs) if paths is None else paths
+
+    downloaded = None
+    if source is None:
+        logger.info('Downloading %s' % XML_URL)
+        source = downloaded = download()
+
+    try:
+        source_hash = file_hash(source)
+        specs = [spec for spec in specs if force or not is_current(paths[spec.name], source_hash)]
+        if not specs:
+            return []
+
+        rows = read_variables(source, [spec.prefix for spec in specs])
+    finally:
+        if downloaded is not None:
+            os.remove(downloaded)
+
+    written = []
+    for spec in specs:
+        dataframe = pandas.DataFrame(rows[spec.prefix], columns=['row_id', 'row_label', 'row_concept'])
+        dataframe = dataframe.sort_values(by='row_id').set_index('row_id')
+
+        module_name, function_name = spec.classifier.split(':')
+        classify = getattr(importlib.import_module(module_name), function_name)
+        classify(dataframe)
+
+        path = paths[spec.name]
+        dataframe.to_csv(path + '.tmp', float_format='%.0f')
+        os.replace(path + '.tmp', path)
+        with open(stamp_path(path), 'w') as stamp:
+            stamp.write(source_hash)
+
+        logger.info('Wrote %d %s variables to %s' % (len(dataframe), spec.name, path))
+        written.append(path)
+
+    return written
@@ -0,0 +1,514 @@
+__author__ = 'linanqiu'
+
+import os
+
+# Default location of the on-disk response cache
+CACHE_DIR = os.environ.get('US_CENSUS_CACHE_DIR',
+                           os.path.join(os.path.expanduser('~'), '.cache', 'us_census'))
+
+# Default maximum size of the response cache before least recently used
+# responses are evicted
+MAX_BYTES = 512 * 1024 * 1024
+
+# Default maximum number of (variable, geography) cells held in memory by
+# VariableCache
+MAX_CELLS = 10 * 1000 * 1000
+
+# Default maximum number of read results held in memory by ResultCache
+MAX_RESULTS = 128
+
+# Default maximum size of the read results held in memory by ResultCache
+MAX_RESULT_BYTES = 256 * 1024 * 1024
+
+import logging
+
+logger = logging.getLogger('ResponseCache')
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from . import geography
+from .geography import FIPS_WIDTHS
+
+
+def normalize_code(key, value):
+    '''
+    Normalizes one geography code, e.g. 'oh' into '39' for states and 35 into
+    '035' for counties
+    :param key: geography of the code, e.g. 'county'
+    :type key: str
+    :param value: code, or '*' for all
+    :type value: str
+    :return: normalized code
+    :rtype: str
+    '''
+    import us.states as states
+
+    value = str(value)
+    if key == 'state' and value != '*':
+        value = states.lookup(value).fips
+    elif key in FIPS_WIDTHS and value.isdigit():
+        value = value.zfill(FIPS_WIDTHS[key])
+    return value
+
+
+def normalize_geo(geo):
+    '''
+    Normalizes a geography filter so that equivalent filters compare equal,
+    e.g. {'state': 'oh', 'county': 35} and {'state': '39', 'county': '035'}.
+    Lists of codes become sorted tuples of distinct codes
+    :param geo: geography filters. e.g. {'state': 'OH', 'county': '*'}
+    :type geo: dict
+    :return: sorted list of (geography, value) pairs
+    :rtype: list[tuple]
+    '''
+    normalized = []
+    for key in sorted(geo):
+        if isinstance(geo[key], (list, tuple, set, frozenset)):
+            value = tuple(sorted(set(normalize_code(key, code) for code in geo[key])))
+        else:
+            value = normalize_code(key, geo[key])
+        normalized.append((key, value))
+    return normalized
+
+
+def normalize_params(params):
+    '''
+    Normalizes read parameters so that equivalent parameters compare equal,
+    e.g. {'sex': 'male', 'age': range(20, 23)} and {'age': [22, 21, 20],
+    'sex': ['male']}. Single values, ranges and lists become sorted tuples of
+    distinct values
+    :param params: parameters as taken by read
+    :type params: dict
+    :return: sorted tuple of (dimension, values) pairs
+    :rtype: tuple
+    '''
+    normalized = []
+    for dimension in sorted(params):
+        values = params[dimension]
+        if not isinstance(values, (range, list, tuple, set, frozenset)):
+            values = [values]
+        normalized.append((dimension, tuple(sorted(set(values), key=repr))))
+    return tuple(normalized)
+
+
+class ResponseCache():
+    '''
+    Persistent cache of Census API responses. Each response is stored as a
+    compressed columnar .npz file, evicted least recently used first once the
+    cache grows beyond max_bytes
+    '''
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_BYTES, ttl=None):
+        '''
+        :param directory: directory the responses are stored in
+        :type directory: str
+        :param max_bytes: maximum total size of stored responses
+        :type max_bytes: int
+        :param ttl: seconds after which a stored response is discarded. None
+        keeps responses forever, which suits the fixed 2010 census
+        :type ttl: float
+        '''
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+    def key(self, dataset, symbols, geo):
+        '''
+        Computes the cache key of a query
+        :param dataset: name of the dataset queried, e.g. '2010/sf1'
+        :type dataset: str
+        :param symbols: variables queried
+        :type symbols: list[str]
+        :param geo: geography filters
+        :type geo: dict
+        :return: hex digest identifying the query
+        :rtype: str
+        '''
+        query = [dataset, sorted(symbols), normalize_geo(geo)]
+        return hashlib.sha1(json.dumps(query).encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def get(self, key):
+        '''
+        Reads a stored response
+        :param key: cache key from self.key
+        :type key: str
+        :return: the stored response, or None if it is missing or expired
+        :rtype: pandas.DataFrame
+        '''
+        import numpy
+        import pandas
+
+        path = self.path(key)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        now = time.time()
+        if self.ttl is not None and now - stat.st_mtime > self.ttl:
+            self.remove(path)
+            return None
+
+        try:
+            with numpy.load(path) as arrays:
+                columns = arrays['__columns__'].tolist()
+                data = {column: arrays['c%d' % i] for i, column in enumerate(columns)}
+        except Exception:
+            logger.warning('Discarding unreadable cache file %s' % path)
+            self.remove(path)
+            return None
+
+        # access time orders eviction, modification time keeps the ttl. The
+        # file may have been evicted by another process since it was read
+        try:
+            os.utime(path, (now, stat.st_mtime))
+        except OSError:
+            pass
+        return pandas.DataFrame(data, columns=columns)
+
+    def set(self, key, dataframe):
+        '''
+        Stores a response, then evicts old responses if the cache is too large
+        :param key: cache key from self.key
+        :type key: str
+        :param dataframe: response to store
+        :type dataframe: pandas.DataFrame
+        :return: None
+        :rtype: None
+        '''
+        import numpy
+        import pandas
+
+        columns = [str(column) for column in dataframe.columns]
+        arrays = {'__columns__': numpy.array(columns)}
+        for i, column in enumerate(dataframe.columns):
+            values = dataframe[column]
+            if pandas.api.types.is_numeric_dtype(values):
+                arrays['c%d' % i] = values.to_numpy()
+            else:
+                arrays['c%d' % i] = values.astype(str).to_numpy(dtype=str)
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        temp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(temp_path, 'wb') as temp_file:
+            numpy.savez_compressed(temp_file, **arrays)
+        os.replace(temp_path, path)
+
+        self.evict()
+
+    def evict(self):
+        '''
+        Removes least recently used responses until the cache fits in
+        self.max_bytes
+        :return: None
+        :rtype: None
+        '''
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.npz'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_atime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self.remove(path)
+            total -= size
+
+    def clear(self):
+        '''
+        Removes every stored response
+        :return: None
+        :rtype: None
+        '''
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz'):
+                self.remove(os.path.join(self.directory, name))
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class VariableCache():
+    '''
+    In-memory cache of individual variable columns for each geography filter,
+    so that overlapping queries only fetch the variables they do not share.
+    Geography filters are evicted least recently used first once more than
+    max_cells cells are held
+    '''
+
+    def __init__(self, max_cells=MAX_CELLS):
+        '''
+        :param max_cells: maximum number of (variable, geography) cells held
+        :type max_cells: int
+        '''
+        self.max_cells = max_cells
+        self.frames = OrderedDict()
+        self.lock = threading.Lock()
+
+    def key(self, dataset, geo):
+        '''
+        Computes the cache key of a geography filter
+        :param dataset: name of the dataset queried, e.g. '2010/sf1'
+        :type dataset: str
+        :param geo: geography filters
+        :type geo: dict
+        :return: hashable key identifying the geography filter
+        :rtype: tuple
+        '''
+        return (dataset,) + tuple(normalize_geo(geo))
+
+    def missing(self, key, symbols):
+        '''
+        Finds the variables that are not cached for a geography filter
+        :param key: cache key from self.key
+        :type key: tuple
+        :param symbols: variables wanted
+        :type symbols: list[str]
+        :return: variables that have to be fetched
+        :rtype: list[str]
+        '''
+        with self.lock:
+            if key not in self.frames:
+                return list(symbols)
+            columns = self.frames[key][1]
+        return [symbol for symbol in symbols if symbol not in columns]
+
+    def add(self, key, dataframe, symbols):
+        '''
+        Adds fetched variable columns for a geography filter
+        :param key: cache key from self.key
+        :type key: tuple
+        :param dataframe: response holding geography columns and symbols
+        :type dataframe: pandas.DataFrame
+        :param symbols: variables held by dataframe
+        :type symbols: list[str]
+        :return: None
+        :rtype: None
+        '''
+        if dataframe.empty:
+            return
+
+        with self.lock:
+            if key in self.frames:
+                cached, columns = self.frames[key]
+                geo_columns = [column for column in cached.columns if column not in columns]
+                new_symbols = [symbol for symbol in symbols if symbol not in columns]
+                cached = cached.merge(dataframe[geo_columns + new_symbols], on=geo_columns, how='inner')
+                columns = columns | set(new_symbols)
+            else:
+                cached, columns = dataframe, set(symbols)
+
+            self.frames[key] = (cached, columns)
+            self.frames.move_to_end(key)
+
+            cells = sum(frame.shape[0] * len(frame_columns) for frame, frame_columns in self.frames.values())
+            while cells > self.max_cells and len(self.frames) > 1:
+                _, (frame, frame_columns) = self.frames.popitem(last=False)
+                cells -= frame.shape[0] * len(frame_columns)
+
+    def roll_up(self, key, symbols):
+        '''
+        Answers variables of a geography filter by summing the cached columns
+        of finer geography filters covering it, e.g. counties of Ohio from
+        the tracts of Ohio, and adds them to the cache
+        :param key: cache key from self.key
+        :type key: tuple
+        :param symbols: variables wanted
+        :type symbols: list[str]
+        :return: variables that no cached geography filter could answer
+        :rtype: list[str]
+        '''
+        geo = dict(key[1:])
+        with self.lock:
+            candidates = [(dict(fine_key[1:]), cached, columns) for fine_key, (cached, columns) in self.frames.items()
+                          if fine_key[0] == key[0] and geography.covers(dict(fine_key[1:]), geo)]
+
+        # coarsest filters first, as they have the fewest units to sum
+        candidates.sort(key=lambda candidate: len(candidate[0]))
+
+        missing = list(symbols)
+        for fine_geo, cached, columns in candidates:
+            found = [symbol for symbol in missing if symbol in columns]
+            if not found:
+                continue
+            logger.info('Rolling up %d variables from %s' % (len(found), sorted(fine_geo.items())))
+            self.add(key, geography.roll_up(cached, found, fine_geo, geo), found)
+            missing = [symbol for symbol in missing if symbol not in columns]
+            if not missing:
+                break
+
+        return missing
+
+    def get(self, key, symbols):
+        '''
+        Assembles the cached columns of a geography filter
+        :param key: cache key from self.key
+        :type key: tuple
+        :param symbols: variables wanted
+        :type symbols: list[str]
+        :return: one row per geography with geography columns and symbols, or
+        None if some of symbols are not cached, e.g. because another thread
+        evicted them since they were added
+        :rtype: pandas.DataFrame
+        '''
+        with self.lock:
+            if key not in self.frames:
+                return None
+            cached, columns = self.frames[key]
+            if any(symbol not in columns for symbol in symbols):
+                return None
+            self.frames.move_to_end(key)
+
+        geo_columns = [column for column in cached.columns if column not in columns]
+        return cached[geo_columns + list(symbols)].copy()
+
+    def clear(self):
+        with self.lock:
+            self.frames.clear()
+
+
+class ResultCache():
+    '''
+    In-memory cache of the DataFrames returned by read, keyed by table,
+    geography and parameters, so that repeating a read skips variable
+    filtering, requests and aggregation. Results are evicted least recently
+    used first once more than max_entries are held or they take more than
+    max_bytes. Results are copied in and out, so callers may modify them
+    '''
+
+    def __init__(self, max_entries=MAX_RESULTS, max_bytes=MAX_RESULT_BYTES):
+        '''
+        :param max_entries: maximum number of results held
+        :type max_entries: int
+        :param max_bytes: maximum total size of the results held, as measured by DataFrame.memory_usage
+        :type max_bytes: int
+        '''
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.results = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def key(self, dataset, table, geo, params, breakdown=None):
+        '''
+        Computes the cache key of a read
+        :param dataset: name of the dataset read, e.g. '2010/sf1'
+        :type dataset: str
+        :param table: name of the table read, e.g. 'population'
+        :type table: str
+        :param geo: geography filters
+        :type geo: dict
+        :param params: parameters of the read
+        :type params: dict
+        :param breakdown: dimensions the read breaks totals down by, or None
+        :type breakdown: list[str]
+        :return: hashable key identifying the read
+        :rtype: tuple
+        '''
+        return (dataset, table, tuple(normalize_geo(geo)), normalize_params(params),
+                tuple(breakdown) if breakdown else None)
+
+    def get(self, key):
+        '''
+        :param key: cache key from self.key
+        :type key: tuple
+        :return: a copy of the stored result, or None if the read is not cached
+        :rtype: pandas.DataFrame
+        '''
+        with self.lock:
+            if key not in self.results:
+                self.misses += 1
+                return None
+            self.results.move_to_end(key)
+            self.hits += 1
+            result = self.results[key][0]
+        return result.copy()
+
+    def add(self, key, dataframe):
+        '''
+        Stores a copy of a result, then evicts old results if the cache holds
+        too many. Results larger than max_bytes are not stored
+        :param key: cache key from self.key
+        :type key: tuple
+        :param dataframe: result of the read
+        :type dataframe: pandas.DataFrame
+        :return: None
+        :rtype: None
+        '''
+        size = int(dataframe.memory_usage(index=True, deep=True).sum())
+        if size > self.max_bytes:
+            return
+        result = dataframe.copy()
+
+        with self.lock:
+            if key in self.results:
+                self.bytes -= self.results.pop(key)[1]
+            self.results[key] = (result, size)
+            self.bytes += size
+
+            while len(self.results) > self.max_entries or self.bytes > self.max_bytes:
+                _, (_, evicted) = self.results.popitem(last=False)
+                self.bytes -= evicted
+
+    def clear(self):
+        with self.lock:
+            self.results.clear()
+            self.bytes = 0
+
+
+# VariableCache and ResultCache shared by every reader created with
+# variable_cache=True and result_cache=True
+shared_cache = None
+shared_results = None
+shared_lock = threading.Lock()
+
+
+def shared_variable_cache():
+    '''
+    The process-wide VariableCache, created on first use. Entries are keyed by
+    dataset and geography, so every table of a dataset shares them
+    :return: shared cache
+    :rtype: VariableCache
+    '''
+    global shared_cache
+
+    with shared_lock:
+        if shared_cache is None:
+            shared_cache = VariableCache()
+        return shared_cache
+
+
+def shared_result_cache():
+    '''
+    The process-wide ResultCache, created on first use
+    :return: shared cache
+    :rtype: ResultCache
+    '''
+    global shared_results
+
+    with shared_lock:
+        if shared_results is None:
+            shared_results = ResultCache()
+        return shared_results
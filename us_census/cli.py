@@ -0,0 +1,364 @@
+'''
+Command line entry point running a grid of reads, every geography of a job
+spec crossed with every parameter set, sharded across a process pool.
+
+    us-census-export job.json output.csv [--processes 8] [--key KEY]
+
+A job spec is a JSON object such as
+
+    {
+        "table": "population",
+        "geo": [{"state": "*", "county": "*"}],
+        "params": [{"sex": "male", "age": {"start": 20, "stop": 25}}, {"sex": "female"}],
+        "breakdown": ["race"]
+    }
+
+where geo and params are an object or a list of objects, ranges are written
+as {"start": a, "stop": b}, and breakdown is optional. Geographies with a
+state are split into one shard per state. Each worker process keeps one
+reader, and its HTTP session, for all of its shards, and writes each shard
+to its own file as soon as it is read. The shards are merged into output,
+a .csv or .parquet file, with a params column holding the JSON of the
+parameters of each row.
+'''
+
+__author__ = 'linanqiu'
+
+# Suffix of the directory holding the shard files of an output file
+SHARD_SUFFIX = '.shards'
+
+# Name of the file recording the job whose shards a shard directory holds
+JOB_NAME = '_job.json'
+
+import logging
+
+logger = logging.getLogger('CLI')
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from . import cache as response_cache
+from . import export
+from . import us_census
+
+# Reader of the worker process, created once by init_worker
+worker_reader = None
+
+
+def load_job(path):
+    '''
+    Reads and validates a job spec
+    :param path: path of the JSON job spec
+    :type path: str
+    :return: job with table, geo and params lists, and breakdown
+    :rtype: dict
+    '''
+    with open(path) as job_file:
+        job = json.load(job_file)
+
+    missing = [key for key in ['table', 'geo', 'params'] if key not in job]
+    if missing:
+        raise NotImplementedError('job spec must contain %s' % ', '.join(missing))
+
+    for key in ['geo', 'params']:
+        if isinstance(job[key], dict):
+            job[key] = [job[key]]
+    job.setdefault('breakdown', None)
+    return job
+
+
+def parse_params(params):
+    '''
+    Converts the parameters of a job spec into parameters taken by read
+    :param params: parameters with ranges written as {"start": a, "stop": b}
+    :type params: dict
+    :return: parameters with ranges
+    :rtype: dict
+    '''
+    result = {}
+    for dimension, value in params.items():
+        if isinstance(value, dict):
+            value = range(value['start'], value['stop'], value.get('step', 1))
+        result[dimension] = value
+    return result
+
+
+def shards(reader, job):
+    '''
+    Splits the grid of a job into shards, one per state of each geography
+    with a state and one per geography without. Each shard holds every
+    parameter set, so that a worker fetches their variables together
+    :param reader: reader of the job's table, used to list states
+    :type reader: reader.CensusReader
+    :param job: job spec from load_job
+    :type job: dict
+    :return: list of (shard name, list of (geo, params) pairs)
+    :rtype: list[tuple]
+    '''
+    result = []
+    for geo in job['geo']:
+        parts = export.partitions(reader, geo) if 'state' in geo else [('all', geo)]
+        for name, part_geo in parts:
+            result.append((name, [(part_geo, params) for params in job['params']]))
+    return result
+
+
+def job_identity(job, output_format):
+    '''
+    Identity of a job, recorded in its shard directory so that only the same
+    job resumes from it. Equivalent filters and parameters give the same
+    identity
+    :param job: job spec from load_job
+    :type job: dict
+    :param output_format: 'csv' or 'parquet'
+    :type output_format: str
+    :return: JSON-compatible identity
+    :rtype: dict
+    '''
+    return json.loads(json.dumps({
+        'table': job['table'],
+        'geo': [response_cache.normalize_geo(geo) for geo in job['geo']],
+        'params': [response_cache.normalize_params(parse_params(params)) for params in job['params']],
+        'breakdown': job['breakdown'],
+        'format': output_format,
+    }))
+
+
+def start_shards(directory, identity, resume):
+    '''
+    Creates the shard directory of a job. Unless resume is set and the
+    directory holds the shards of the same job, the shards of an earlier run
+    are deleted
+    :param directory: shard directory
+    :type directory: str
+    :param identity: identity of the job, from job_identity
+    :type identity: dict
+    :param resume: keep the shard files written by an earlier run of the same job
+    :type resume: bool
+    :return: None
+    :rtype: None
+    '''
+    job_path = os.path.join(directory, JOB_NAME)
+    if resume:
+        try:
+            with open(job_path) as job_file:
+                if json.load(job_file) == identity:
+                    return
+        except (OSError, ValueError):
+            pass
+        logger.info('%s holds no shards of this job, starting over' % directory)
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+    with open(job_path, 'w') as job_file:
+        json.dump(identity, job_file, indent=1)
+
+
+def shard_path(directory, index, output_format):
+    return os.path.join(directory, 'shard-%05d.%s' % (index, output_format))
+
+
+def init_worker(table, CENSUS_API_KEY, reader_options):
+    '''
+    Creates the reader of a worker process, reused by all of its shards
+    :param table: name of the table, e.g. 'population'
+    :type table: str
+    :param CENSUS_API_KEY: Census API key
+    :type CENSUS_API_KEY: str
+    :param reader_options: passed on to DataReader
+    :type reader_options: dict
+    :return: None
+    :rtype: None
+    '''
+    global worker_reader
+    worker_reader = us_census.DataReader(table, CENSUS_API_KEY, **reader_options)
+
+
+def run_shard(path, specs, breakdown):
+    '''
+    Reads one shard in a worker process and writes it to path
+    :param path: shard file, .csv or .parquet
+    :type path: str
+    :param specs: (geo, params) pairs of the shard, with params as in the job spec
+    :type specs: list[tuple]
+    :param breakdown: dimensions to break totals down by, or None
+    :type breakdown: list[str]
+    :return: number of rows written and of Census API requests sent
+    :rtype: tuple
+    '''
+    import pandas
+
+    requests = []
+    hook = lambda read_stats: requests.append(read_stats.counters['requests'])
+    worker_reader.add_hook(hook)
+    try:
+        parsed = [(geo, parse_params(params)) for geo, params in specs]
+        if breakdown:
+            frames = [worker_reader.read(geo, params, breakdown) for geo, params in parsed]
+        else:
+            frames = worker_reader.read_many(parsed)
+    finally:
+        worker_reader.remove_hook(hook)
+
+    for frame, (_, params) in zip(frames, specs):
+        frame['params'] = json.dumps(params, sort_keys=True)
+    dataframe = pandas.concat(frames, ignore_index=True)
+
+    write_frame(dataframe, path + '.tmp', path)
+    os.replace(path + '.tmp', path)
+    return len(dataframe), sum(requests)
+
+
+def write_frame(dataframe, path, output_path):
+    '''
+    Writes a DataFrame in the format given by the extension of output_path
+    :param dataframe: frame to write
+    :type dataframe: pandas.DataFrame
+    :param path: file to write
+    :type path: str
+    :param output_path: path whose extension, .csv or .parquet, sets the format
+    :type output_path: str
+    :return: None
+    :rtype: None
+    '''
+    if output_path.endswith('.parquet'):
+        dataframe.to_parquet(path, index=False)
+    else:
+        dataframe.to_csv(path, index=False)
+
+
+def merge_shards(paths, output):
+    '''
+    Concatenates shard files, in order, into the output file
+    :param paths: shard files
+    :type paths: list[str]
+    :param output: output file, .csv or .parquet
+    :type output: str
+    :return: number of rows written
+    :rtype: int
+    '''
+    import pandas
+
+    if output.endswith('.parquet'):
+        frames = [pandas.read_parquet(path) for path in paths]
+    else:
+        # read codes as strings, so that zero-padded codes keep their zeros
+        frames = [pandas.read_csv(path, dtype=str, keep_default_na=False) for path in paths]
+
+    dataframe = pandas.concat(frames, ignore_index=True) if frames else pandas.DataFrame()
+    write_frame(dataframe, output + '.tmp', output)
+    os.replace(output + '.tmp', output)
+    return len(dataframe)
+
+
+def run(job, output, CENSUS_API_KEY, processes=None, reader_options=None, resume=False, keep_shards=False,
+        progress=sys.stderr):
+    '''
+    Runs a job across a process pool and merges its shards into output
+    :param job: job spec from load_job
+    :type job: dict
+    :param output: output file, .csv or .parquet
+    :type output: str
+    :param CENSUS_API_KEY: Census API key
+    :type CENSUS_API_KEY: str
+    :param processes: number of worker processes, defaults to the number of CPUs
+    :type processes: int
+    :param reader_options: passed on to DataReader in each worker
+    :type reader_options: dict
+    :param resume: keep the shard files written by an earlier run of the same job
+    :type resume: bool
+    :param keep_shards: keep the shard files once merged
+    :type keep_shards: bool
+    :param progress: stream receiving a line per completed shard, or None
+    :type progress: file
+    :return: number of rows written
+    :rtype: int
+    '''
+    # each shard is read once, so workers keep no results in memory
+    reader_options = dict(reader_options or {})
+    reader_options.setdefault('result_cache', False)
+    output_format = 'parquet' if output.endswith('.parquet') else 'csv'
+    if output_format == 'parquet':
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError('parquet output requires pyarrow: pip install us_census[parquet]')
+
+    reader = us_census.DataReader(job['table'], CENSUS_API_KEY, **reader_options)
+    job_shards = shards(reader, job)
+
+    directory = output + SHARD_SUFFIX
+    start_shards(directory, job_identity(job, output_format), resume)
+
+    paths = [shard_path(directory, index, output_format) for index in range(len(job_shards))]
+    todo = [index for index, path in enumerate(paths) if not os.path.exists(path)]
+    logger.info('Running %d shards, %d already written' % (len(todo), len(paths) - len(todo)))
+
+    start = time.perf_counter()
+    rows = requests = 0
+    failed = []
+    with ProcessPoolExecutor(max_workers=processes, initializer=init_worker,
+                             initargs=(job['table'], CENSUS_API_KEY, reader_options)) as executor:
+        futures = {executor.submit(run_shard, paths[index], job_shards[index][1], job['breakdown']): index
+                   for index in todo}
+        for done, future in enumerate(as_completed(futures), 1):
+            index = futures[future]
+            try:
+                shard_rows, shard_requests = future.result()
+            except Exception as e:
+                logger.warning('Shard %s failed: %s' % (job_shards[index][0], e))
+                failed.append(job_shards[index][0])
+                continue
+
+            rows += shard_rows
+            requests += shard_requests
+            if progress is not None:
+                elapsed = time.perf_counter() - start
+                progress.write('[%d/%d] %s: %d rows, %.1f shards/s, %.0f rows/s, %d requests\n'
+                               % (done, len(todo), job_shards[index][0], shard_rows, done / elapsed, rows / elapsed,
+                                  requests))
+                progress.flush()
+
+    if failed:
+        raise RuntimeError('%d shards failed and can be resumed with --resume: %s'
+                           % (len(failed), ', '.join(failed)))
+
+    written = merge_shards(paths, output)
+    if not keep_shards:
+        shutil.rmtree(directory, ignore_errors=True)
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Runs a grid of us_census reads across a process pool')
+    parser.add_argument('job', help='JSON job spec with table, geo, params and optionally breakdown')
+    parser.add_argument('output', help='output file, .csv or .parquet')
+    parser.add_argument('--key', default=os.environ.get('CENSUS_API_KEY'),
+                        help='Census API key, defaults to the CENSUS_API_KEY environment variable')
+    parser.add_argument('--processes', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--max-workers', type=int, default=None, help='chunk requests in flight per process')
+    parser.add_argument('--no-cache', action='store_true', help='disable the on-disk response cache')
+    parser.add_argument('--resume', action='store_true', help='keep the shards written by an earlier run')
+    parser.add_argument('--keep-shards', action='store_true', help='keep the shard files once merged')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+
+    reader_options = {}
+    if args.max_workers is not None:
+        reader_options['max_workers'] = args.max_workers
+    if args.no_cache:
+        reader_options['cache'] = False
+
+    rows = run(load_job(args.job), args.output, args.key, args.processes, reader_options, args.resume,
+               args.keep_shards)
+    sys.stderr.write('Wrote %d rows to %s\n' % (rows, args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,392 @@
+__author__ = 'linanqiu'
+
+# Name of the file recording the partitions already written
+MANIFEST_NAME = '_manifest.json'
+
+# Number of partitions fetched at the same time
+MAX_WORKERS = 4
+
+# Maximum number of rows of each DataFrame yielded by iter_read
+BATCH_SIZE = 10000
+
+import logging
+
+logger = logging.getLogger('Export')
+
+import glob
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from . import cache as response_cache
+from . import geography
+
+
+def partitions(reader, geo, by_county=False):
+    '''
+    Splits a geography filter into one filter per state, and per county if
+    by_county is set and geo asks for every county
+    :param reader: reader used to list the counties of each state
+    :type reader: reader.CensusReader
+    :param geo: geography filters. e.g. {'state': '*', 'county': '*', 'tract': '*'}
+    :type geo: dict
+    :param by_county: split each state into its counties
+    :type by_county: bool
+    :return: list of (partition name, geography filters) pairs
+    :rtype: list[tuple]
+    '''
+    result = []
+    for name, state_geo in state_partitions(geo):
+        if not by_county or geo.get('county') != '*':
+            result.append((name, state_geo))
+            continue
+
+        counties = reader.fetch_census([total_symbol(reader)], {'state': state_geo['state'], 'county': '*'})
+        result.extend(county_partitions(name, state_geo, counties))
+
+    return result
+
+
+def state_partitions(geo):
+    '''
+    Splits a geography filter into one filter per state
+    :param geo: geography filters. e.g. {'state': '*', 'county': '*', 'tract': '*'}
+    :type geo: dict
+    :return: list of (partition name, geography filters) pairs, e.g. ('state=OH', {'state': '39', ...})
+    :rtype: list[tuple]
+    '''
+    import us.states as states
+
+    state = geo.get('state', '*')
+    if state == '*':
+        state_codes = geography.state_fips_codes()
+    elif isinstance(state, (list, tuple, set, frozenset)):
+        state_codes = sorted(set(states.lookup(str(code)).fips for code in state))
+    else:
+        state_codes = [states.lookup(str(state)).fips]
+
+    return [('state=%s' % states.lookup(state_fips).abbr, dict(geo, state=state_fips)) for state_fips in state_codes]
+
+
+def total_symbol(reader):
+    # the first variable of each lookup table is the table total
+    return reader.api_lookup['row_id'].iloc[0]
+
+
+def county_partitions(name, state_geo, counties):
+    '''
+    Splits the partition of a state into one partition per county
+    :param name: name of the state's partition, e.g. 'state=OH'
+    :type name: str
+    :param state_geo: geography filters of the state's partition
+    :type state_geo: dict
+    :param counties: response listing the counties of the state
+    :type counties: pandas.DataFrame
+    :return: list of (partition name, geography filters) pairs
+    :rtype: list[tuple]
+    '''
+    return [('%s/county=%s' % (name, county), dict(state_geo, county=county))
+            for county in sorted(geography.pad_fips(counties['county'], 'county'))]
+
+
+def job_identity(reader, geo, params, by_county):
+    '''
+    Identity of an export, recorded in its manifest so that only the same
+    export resumes from it. Equivalent filters and parameters give the same
+    identity
+    :param reader: reader of the export
+    :type reader: reader.CensusReader
+    :param geo: geography filters of the export
+    :type geo: dict
+    :param params: parameters of the export
+    :type params: dict
+    :param by_county: whether the export splits states into counties
+    :type by_county: bool
+    :return: JSON-compatible identity
+    :rtype: dict
+    '''
+    return json.loads(json.dumps({'table': reader.table, 'geo': response_cache.normalize_geo(geo),
+                                  'params': response_cache.normalize_params(params), 'by_county': by_county}))
+
+
+def read_manifest(path, job):
+    '''
+    Reads the names of the partitions already written to path by job
+    :param path: directory of the dataset
+    :type path: str
+    :param job: identity of the export, from job_identity
+    :type job: dict
+    :return: names of the completed partitions, or None if path holds no
+    manifest of job
+    :rtype: set[str]
+    '''
+    try:
+        with open(os.path.join(path, MANIFEST_NAME)) as manifest:
+            manifest = json.load(manifest)
+        if manifest['job'] == job:
+            return set(manifest['completed'])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+
+def write_manifest(path, job, completed):
+    '''
+    Atomically records the identity of an export and the names of the
+    partitions it wrote to path
+    :param path: directory of the dataset
+    :type path: str
+    :param job: identity of the export, from job_identity
+    :type job: dict
+    :param completed: names of the completed partitions
+    :type completed: set[str]
+    :return: None
+    :rtype: None
+    '''
+    manifest_path = os.path.join(path, MANIFEST_NAME)
+    with open(manifest_path + '.tmp', 'w') as manifest:
+        json.dump({'job': job, 'completed': sorted(completed)}, manifest, indent=1)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+
+def clear_partitions(path):
+    '''
+    Deletes the partition files, and the temporary files of interrupted
+    writes, left in path by an earlier export
+    :param path: directory of the dataset
+    :type path: str
+    :return: None
+    :rtype: None
+    '''
+    for directory in glob.glob(os.path.join(path, 'state=*')):
+        for name in os.listdir(directory):
+            if name.startswith(('part-', '.part-')):
+                os.remove(os.path.join(directory, name))
+        if not os.listdir(directory):
+            os.rmdir(directory)
+
+
+def write_partition(dataframe, path, name):
+    '''
+    Writes one partition as a parquet file in a hive-style directory, e.g.
+    path/state=OH/part-035.parquet. The state column is encoded by the
+    directory and not stored in the file. The file is written under a
+    hidden temporary name first, which parquet readers skip
+    :param dataframe: result of read for the partition
+    :type dataframe: pandas.DataFrame
+    :param path: directory of the dataset
+    :type path: str
+    :param name: partition name, e.g. 'state=OH' or 'state=OH/county=035'
+    :type name: str
+    :return: None
+    :rtype: None
+    '''
+    parts = name.split('/')
+    directory = os.path.join(path, parts[0])
+    os.makedirs(directory, exist_ok=True)
+
+    suffix = parts[1].split('=')[1] if len(parts) > 1 else '0'
+    file_path = os.path.join(directory, 'part-%s.parquet' % suffix)
+
+    dataframe = dataframe.drop(columns=['state'])
+    temp_path = os.path.join(directory, '.part-%s.parquet.tmp' % suffix)
+    dataframe.to_parquet(temp_path, index=False)
+    os.replace(temp_path, file_path)
+
+
+def export(reader, path, geo, params, by_county=False, max_workers=MAX_WORKERS, resume=True):
+    '''
+    Reads geo state by state, and county by county if by_county is set,
+    streaming each partition to a parquet dataset under path as soon as it is
+    fetched. Completed partitions are recorded in a manifest so that a failed
+    export resumes where it stopped. An export with other geo, params or
+    by_county starts over, deleting the partitions of the earlier one. Read
+    the result with
+    pandas.read_parquet(path)
+    :param reader: reader to query with
+    :type reader: reader.CensusReader
+    :param path: directory of the dataset
+    :type path: str
+    :param geo: geography filters. e.g. {'state': '*', 'county': '*', 'tract': '*'}
+    :type geo: dict
+    :param params: parameters as taken by reader.read
+    :type params: dict
+    :param by_county: split each state into its counties
+    :type by_county: bool
+    :param max_workers: number of partitions fetched at the same time
+    :type max_workers: int
+    :param resume: skip the partitions recorded in the manifest of the same export
+    :type resume: bool
+    :return: names of the partitions written by this call
+    :rtype: list[str]
+    '''
+    job = job_identity(reader, geo, params, by_county)
+    completed = start_export(path, geo, job, resume)
+
+    symbols, weights = reader.resolve(params)
+
+    todo = [(name, part_geo) for name, part_geo in partitions(reader, geo, by_county) if name not in completed]
+    logger.info('Exporting %d partitions, %d already completed' % (len(todo), len(completed)))
+
+    def read_partition(part_geo):
+        # bypass the in-memory variable cache so partitions are not retained
+        return reader.aggregate(reader.fetch_census(symbols, part_geo), symbols, part_geo, weights)
+
+    written = []
+    failed = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(read_partition, part_geo): name for name, part_geo in todo}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                dataframe = future.result()
+            except Exception as e:
+                logger.warning('Partition %s failed: %s' % (name, e))
+                failed.append(name)
+                continue
+
+            record_partition(dataframe, path, job, name, completed)
+            written.append(name)
+            logger.info('Wrote partition %s (%d of %d)' % (name, len(written), len(todo)))
+
+    check_failed(failed)
+    return written
+
+
+def start_export(path, geo, job, resume):
+    '''
+    Checks that an export can run and creates its directory. Unless resume is
+    set and path holds the manifest of the same export, the partitions of an
+    earlier export are deleted and the export starts over
+    :param path: directory of the dataset
+    :type path: str
+    :param geo: geography filters of the export
+    :type geo: dict
+    :param job: identity of the export, from job_identity
+    :type job: dict
+    :param resume: skip the partitions recorded in the manifest of the same export
+    :type resume: bool
+    :return: names of the partitions already completed
+    :rtype: set[str]
+    '''
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError('export writes parquet files and requires pyarrow: pip install us_census[parquet]')
+
+    if 'state' not in geo:
+        raise NotImplementedError('export splits geographies by state, so geo must contain a state')
+
+    os.makedirs(path, exist_ok=True)
+    completed = read_manifest(path, job) if resume else None
+    if completed is None:
+        clear_partitions(path)
+        completed = set()
+        write_manifest(path, job, completed)
+    return completed
+
+
+def record_partition(dataframe, path, job, name, completed):
+    '''
+    Writes a partition and records it in the manifest
+    :param dataframe: result of read for the partition
+    :type dataframe: pandas.DataFrame
+    :param path: directory of the dataset
+    :type path: str
+    :param job: identity of the export, from job_identity
+    :type job: dict
+    :param name: partition name, e.g. 'state=OH'
+    :type name: str
+    :param completed: names of the completed partitions, to which name is added
+    :type completed: set[str]
+    :return: None
+    :rtype: None
+    '''
+    write_partition(dataframe, path, name)
+    completed.add(name)
+    write_manifest(path, job, completed)
+
+
+def check_failed(failed):
+    if failed:
+        raise RuntimeError('%d partitions failed and can be resumed: %s' % (len(failed), ', '.join(sorted(failed))))
+
+
+def iter_read(reader, geo, params, breakdown=None, by_county=False, batch_size=BATCH_SIZE):
+    '''
+    Reads geo one state at a time, or one county at a time if by_county is set,
+    yielding the results in DataFrames of at most batch_size rows. Only one
+    partition's response is held at once, and it is aggregated batch by batch
+    :param reader: reader to query with
+    :type reader: reader.CensusReader
+    :param geo: geography filters. e.g. {'state': '*', 'county': '*', 'tract': '*'}
+    :type geo: dict
+    :param params: parameters as taken by reader.read
+    :type params: dict
+    :param breakdown: dimensions to break totals down by, as taken by reader.read
+    :type breakdown: list[str]
+    :param by_county: split each state into its counties
+    :type by_county: bool
+    :param batch_size: maximum number of rows per DataFrame
+    :type batch_size: int
+    :return: generator of DataFrames with the columns of reader.read
+    :rtype: generator
+    '''
+    plan = BatchPlan(reader, params, breakdown, batch_size)
+
+    parts = partitions(reader, geo, by_county) if 'state' in geo else [('all', geo)]
+    for name, part_geo in parts:
+        logger.info('Reading partition %s' % name)
+        # bypass the in-memory variable cache so partitions are not retained
+        dataframe = reader.fetch_census(plan.symbols, part_geo)
+        for batch in plan.batches(dataframe, part_geo):
+            yield batch
+        del dataframe
+
+
+class BatchPlan():
+    '''
+    Variables read by iter_read and the number of units per batch, so that
+    batches of breakdowns stay within batch_size rows
+    '''
+
+    def __init__(self, reader, params, breakdown=None, batch_size=BATCH_SIZE):
+        '''
+        :param reader: reader to query with
+        :type reader: reader.CensusReader
+        :param params: parameters as taken by reader.read
+        :type params: dict
+        :param breakdown: dimensions to break totals down by, as taken by reader.read
+        :type breakdown: list[str]
+        :param batch_size: maximum number of rows per DataFrame
+        :type batch_size: int
+        '''
+        self.reader = reader
+        self.breakdown = breakdown
+        if breakdown:
+            self.api_variables = reader.filter_api_variable(reader.breakdown_params(params, breakdown))
+            self.symbols, self.weights = self.api_variables['row_id'].tolist(), None
+        else:
+            self.api_variables = None
+            self.symbols, self.weights = reader.resolve(params)
+
+        # rows returned for each geography
+        cells = len(self.api_variables.groupby(list(breakdown))) if breakdown else 1
+        self.units = max(1, batch_size // max(cells, 1))
+
+    def batches(self, dataframe, geo):
+        '''
+        Aggregates a partition's response batch by batch
+        :param dataframe: response holding self.symbols for geo
+        :type dataframe: pandas.DataFrame
+        :param geo: geography filters of the partition
+        :type geo: dict
+        :return: generator of DataFrames with the columns of reader.read
+        :rtype: generator
+        '''
+        for start in range(0, len(dataframe), self.units):
+            batch = dataframe.iloc[start:start + self.units]
+            if self.breakdown:
+                yield self.reader.aggregate_breakdown(batch, self.api_variables, self.breakdown, geo)
+            else:
+                yield self.reader.aggregate(batch, self.symbols, geo, self.weights)
@@ -0,0 +1,243 @@
+__author__ = 'linanqiu'
+
+# Width of the zero-padded FIPS codes returned for each geography
+FIPS_WIDTHS = {'county': 3}
+
+# Column of the Census API response holding each geography of read's geo
+# filters, where it differs from the geography name
+GEO_COLUMNS = {
+    'subdivision': 'county subdivision',
+    'district': 'congressional district',
+    'msa': 'metropolitan statistical area/micropolitan statistical area (or part)',
+    'csa': 'combined statistical area (or part)',
+    'zipcode': 'zip code tabulation area (or part)',
+}
+
+# Geography filters accepted by the Census API, as sorted geographies, and
+# the geography each asks for. The others are its 'in' clauses, state first
+SHAPES = {
+    ('state',): 'state',
+    ('county', 'state'): 'county',
+    ('county', 'state', 'subdivision'): 'subdivision',
+    ('county', 'state', 'tract'): 'tract',
+    ('place', 'state'): 'place',
+    ('district', 'state'): 'district',
+    ('msa', 'state'): 'msa',
+    ('csa', 'state'): 'csa',
+    ('district', 'place', 'state'): 'place',
+    ('state', 'zipcode'): 'zipcode',
+}
+
+# Geography each geography nests within. The units of a geography partition
+# their parent, so parent totals are sums over the units
+PARENTS = {'county': 'state', 'tract': 'county', 'subdivision': 'county'}
+
+# FIPS code to state abbreviation, filled on first use
+state_abbreviations = {}
+
+
+def geo_column(key, geo):
+    '''
+    Column of the Census API response holding a geography
+    :param key: geography of the geo filters, e.g. 'subdivision'
+    :type key: str
+    :param geo: geography filters the response was queried with
+    :type geo: dict
+    :return: column name, e.g. 'county subdivision'
+    :rtype: str
+    '''
+    if key == 'place' and 'district' in geo:
+        return 'place/remainder (or part)'
+    return GEO_COLUMNS.get(key, key)
+
+
+def api_clauses(geo):
+    '''
+    Converts geography filters into the 'for' and 'in' parameters of a Census
+    API request, e.g. {'state': 'OH', 'county': '*'} into
+    {'for': 'county:*', 'in': 'state:39'}
+    :param geo: geography filters, each a code or '*'
+    :type geo: dict
+    :return: request parameters
+    :rtype: dict
+    '''
+    import us.states as states
+
+    shape = tuple(sorted(geo))
+    if shape not in SHAPES:
+        raise NotImplementedError('geo must have the geographies of one of %s'
+                                  % ', '.join('(%s)' % ', '.join(keys) for keys in SHAPES))
+
+    codes = dict(geo)
+    if codes['state'] != '*':
+        codes['state'] = states.lookup(str(codes['state'])).fips
+
+    target = SHAPES[shape]
+    clauses = {'for': '%s:%s' % (geo_column(target, geo), codes[target])}
+    within = ['state'] + [key for key in shape if key not in (target, 'state')]
+    if target != 'state':
+        clauses['in'] = ' '.join('%s:%s' % (geo_column(key, geo), codes[key]) for key in within)
+    return clauses
+
+
+def is_level(keys):
+    '''
+    Checks that geography keys form a level of the state, county, tract
+    hierarchy, i.e. every geography comes with the geography it nests within
+    :param keys: geographies of a geography filter
+    :type keys: set[str]
+    :return: whether the keys form a level
+    :rtype: bool
+    '''
+    return 'state' in keys and all(key in PARENTS and PARENTS[key] in keys for key in keys - {'state'})
+
+
+def covers(fine_geo, geo):
+    '''
+    Checks whether the units of a finer geography filter partition every unit
+    of geo, so that geo can be answered by summing them. e.g.
+    {'state': '39', 'county': '*', 'tract': '*'} covers {'state': '39', 'county': '*'}
+    and {'state': '39'} but not {'state': '*'}
+    :param fine_geo: normalized geography filter of the finer units
+    :type fine_geo: dict
+    :param geo: normalized geography filter of the units wanted
+    :type geo: dict
+    :return: whether fine_geo covers geo
+    :rtype: bool
+    '''
+    fine_keys, keys = set(fine_geo), set(geo)
+    if not (keys < fine_keys and is_level(keys) and is_level(fine_keys)):
+        return False
+    if any(fine_geo[key] != '*' for key in fine_keys - keys):
+        return False
+    return all(fine_geo[key] in ('*', geo[key]) for key in keys)
+
+
+def roll_up(dataframe, symbols, fine_geo, geo):
+    '''
+    Sums the variables of finer units into the units of geo
+    :param dataframe: response for fine_geo, with geography and variable columns
+    :type dataframe: pandas.DataFrame
+    :param symbols: variables to sum
+    :type symbols: list[str]
+    :param fine_geo: normalized geography filter of dataframe, covering geo
+    :type fine_geo: dict
+    :param geo: normalized geography filter of the units wanted
+    :type geo: dict
+    :return: one row per unit of geo, with geography and variable columns
+    :rtype: pandas.DataFrame
+    '''
+    import numpy
+    import pandas
+
+    keys = sorted(geo)
+    columns = [geo_column(key, geo) for key in keys]
+
+    mask = numpy.ones(len(dataframe), dtype=bool)
+    for key, column in zip(keys, columns):
+        if geo[key] != '*' and fine_geo[key] == '*':
+            mask &= dataframe[geo_column(key, fine_geo)].astype(str).to_numpy() == geo[key]
+
+    selected = dataframe[mask]
+    values = pandas.DataFrame(selected[symbols].to_numpy(dtype='float64'), columns=symbols)
+    for key, column in zip(keys, columns):
+        values[column] = selected[geo_column(key, fine_geo)].to_numpy()
+
+    return values.groupby(columns, sort=False, as_index=False)[symbols].sum()
+
+
+def unit_columns(dataframe, geo):
+    '''
+    Geography columns of read's results for a Census API response: one column
+    per geography of geo, with state abbreviations and zero-padded county codes
+    :param dataframe: response of the Census API
+    :type dataframe: pandas.DataFrame
+    :param geo: geography filters the response was queried with
+    :type geo: dict
+    :return: geography to column
+    :rtype: dict
+    '''
+    columns = {}
+    for key in geo:
+        columns[key] = dataframe[geo_column(key, geo)]
+
+    if 'state' in geo:
+        columns['state'] = abbreviate_states(dataframe['state'])
+
+    if 'county' in geo:
+        columns['county'] = pad_fips(dataframe['county'], 'county')
+
+    return columns
+
+
+def state_fips_codes():
+    '''
+    FIPS codes of every state covered by the 2010 census summary files: the
+    50 states, the District of Columbia and Puerto Rico
+    :return: state FIPS codes, e.g. '39'
+    :rtype: list[str]
+    '''
+    import us.states as states
+
+    return sorted(set([state.fips for state in states.STATES] + [states.DC.fips, states.PR.fips]))
+
+
+def abbreviate_states(state_fips):
+    '''
+    Converts a column of state FIPS codes into a categorical column of state
+    abbreviations. Only the distinct codes are looked up
+    :param state_fips: state FIPS codes, e.g. '39'
+    :type state_fips: pandas.Series
+    :return: state abbreviations, e.g. 'OH'
+    :rtype: pandas.Series
+    '''
+    import pandas
+
+    if not state_abbreviations:
+        import us.states as states
+        for state in states.STATES_AND_TERRITORIES:
+            state_abbreviations[state.fips] = state.abbr
+
+    categorical = pandas.Categorical(state_fips)
+    abbreviations = [state_abbreviations.get(str(fips).zfill(2), str(fips)) for fips in categorical.categories]
+    return pandas.Series(categorical.rename_categories(abbreviations), index=state_fips.index, name=state_fips.name)
+
+
+def pad_fips(codes, geography):
+    '''
+    Converts a column of FIPS codes into zero-padded strings, e.g. 35 and
+    '35' into '035' for counties
+    :param codes: FIPS codes
+    :type codes: pandas.Series
+    :param geography: geography of the codes, e.g. 'county'
+    :type geography: str
+    :return: zero-padded FIPS codes
+    :rtype: pandas.Series
+    '''
+    import pandas
+
+    if pandas.api.types.is_float_dtype(codes):
+        codes = codes.astype('int64')
+    return codes.astype(str).str.zfill(FIPS_WIDTHS[geography])
+
+
+def sum_columns(dataframe, symbols, weights=None):
+    '''
+    Sums variable columns row by row with one numeric conversion
+    :param dataframe: response of the Census API
+    :type dataframe: pandas.DataFrame
+    :param symbols: variable columns to sum
+    :type symbols: list[str]
+    :param weights: weight of each column, 1 or -1, or None to add every column
+    :type weights: list[int]
+    :return: row totals
+    :rtype: pandas.Series of int64
+    '''
+    import numpy
+    import pandas
+
+    values = dataframe[symbols].to_numpy(dtype='float64')
+    if weights is not None and any(weight != 1 for weight in weights):
+        values = values * numpy.asarray(weights, dtype='float64')
+    totals = numpy.nansum(values, axis=1).round().astype('int64')
+    return pandas.Series(totals, index=dataframe.index)
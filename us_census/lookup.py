@@ -0,0 +1,399 @@
+__author__ = 'linanqiu'
+
+import os
+
+from .cache import CACHE_DIR
+
+# Directory holding binary snapshots of the lookup tables and their indexes
+SNAPSHOT_DIR = os.path.join(CACHE_DIR, 'lookup')
+
+# Version of the snapshot format, part of snapshot names so that snapshots
+# of older versions are rebuilt
+SNAPSHOT_VERSION = 3
+
+# Separator of the levels of the row_label of a variable, e.g.
+# 'Male: !! 5 years'
+LABEL_SEPARATOR = ' !! '
+
+import logging
+
+logger = logging.getLogger('LookupIndex')
+
+import hashlib
+import itertools
+import math
+import threading
+
+# Lookup tables loaded by this process, shared read-only by every reader
+loaded_tables = {}
+load_lock = threading.Lock()
+
+
+def load_lookup(path, dimensions):
+    '''
+    Loads a variable lookup table and builds its index once per process. The
+    result is shared by every reader and thread, and must not be modified
+    :param path: path of the lookup csv, e.g. population.csv
+    :type path: str
+    :param dimensions: columns of the table that parameters filter on
+    :type dimensions: list[str]
+    :return: the lookup table and its LookupIndex
+    :rtype: tuple
+    '''
+    key = (path, tuple(dimensions))
+    table = loaded_tables.get(key)
+    if table is None:
+        with load_lock:
+            table = loaded_tables.get(key)
+            if table is None:
+                table = load_snapshot(path, dimensions)
+                loaded_tables[key] = table
+    return table
+
+
+def load_snapshot(path, dimensions):
+    '''
+    Reads the snapshot of the lookup table and index of a lookup csv, parsing
+    the csv and writing the snapshot first if the csv changed since the last
+    snapshot
+    :param path: path of the lookup csv
+    :type path: str
+    :param dimensions: columns of the table that parameters filter on
+    :type dimensions: list[str]
+    :return: the lookup table and its LookupIndex
+    :rtype: tuple
+    '''
+    import pandas
+
+    stat = os.stat(path)
+    source = '%s:%d:%d:%s:%s:%d' % (os.path.abspath(path), stat.st_size, stat.st_mtime_ns, ','.join(dimensions),
+                                    pandas.__version__, SNAPSHOT_VERSION)
+    name = os.path.basename(path) + '.' + hashlib.sha1(source.encode('utf-8')).hexdigest() + '.npz'
+    snapshot_path = os.path.join(SNAPSHOT_DIR, name)
+
+    try:
+        return read_snapshot(snapshot_path, dimensions)
+    except Exception:
+        pass
+
+    api_lookup = pandas.read_csv(path)
+    table = (api_lookup, LookupIndex(api_lookup, dimensions))
+
+    try:
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        temp_path = '%s.%d.tmp' % (snapshot_path, os.getpid())
+        with open(temp_path, 'wb') as snapshot:
+            write_snapshot(snapshot, *table)
+        os.replace(temp_path, snapshot_path)
+    except OSError:
+        logger.info('Could not write lookup snapshot %s' % snapshot_path)
+
+    return table
+
+
+def write_snapshot(snapshot, api_lookup, index):
+    '''
+    Writes a lookup table and the hierarchy of its index as the arrays of an
+    .npz file, which unlike a pickle cannot run code when loaded from a
+    shared cache directory. Text columns are stored as strings and columns of
+    booleans as booleans, each with a mask of missing values
+    :param snapshot: file to write
+    :type snapshot: file
+    :param api_lookup: variable lookup table
+    :type api_lookup: pandas.DataFrame
+    :param index: index of api_lookup
+    :type index: LookupIndex
+    :return: None
+    :rtype: None
+    '''
+    import numpy
+    import pandas
+
+    columns = [str(column) for column in api_lookup.columns]
+    arrays = {'__columns__': numpy.array(columns), '__kinds__': numpy.empty(len(columns), dtype='U7')}
+    for i, column in enumerate(api_lookup.columns):
+        values = api_lookup[column]
+        if pandas.api.types.is_numeric_dtype(values) and values.dtype != object:
+            arrays['__kinds__'][i] = 'numeric'
+            arrays['c%d' % i] = values.to_numpy()
+            continue
+
+        missing = values.isna().to_numpy()
+        present = values[~missing]
+        if len(present) and all(isinstance(value, (bool, numpy.bool_)) for value in present):
+            arrays['__kinds__'][i] = 'bool'
+            arrays['c%d' % i] = numpy.where(missing, False, values.to_numpy(dtype=object)).astype(bool)
+        else:
+            arrays['__kinds__'][i] = 'str'
+            arrays['c%d' % i] = numpy.where(missing, '', values.to_numpy(dtype=object)).astype(str)
+        arrays['m%d' % i] = missing
+
+    length = len(api_lookup)
+    arrays['__parents__'] = numpy.array([index.parents.get(position, -1) for position in range(length)],
+                                        dtype='int64')
+    arrays['__closed__'] = numpy.isin(numpy.arange(length), sorted(index.closed))
+    numpy.savez(snapshot, **arrays)
+
+
+def read_snapshot(path, dimensions):
+    '''
+    Reads a snapshot written by write_snapshot
+    :param path: path of the .npz snapshot
+    :type path: str
+    :param dimensions: columns of the table that parameters filter on
+    :type dimensions: list[str]
+    :return: the lookup table and its LookupIndex
+    :rtype: tuple
+    '''
+    import numpy
+    import pandas
+
+    data = {}
+    with numpy.load(path, allow_pickle=False) as arrays:
+        columns = arrays['__columns__'].tolist()
+        for i, (column, kind) in enumerate(zip(columns, arrays['__kinds__'].tolist())):
+            values = arrays['c%d' % i]
+            if kind != 'numeric':
+                values = values.astype(object)
+                values[arrays['m%d' % i]] = numpy.nan
+            data[column] = values
+        hierarchy = (arrays['__parents__'].tolist(), arrays['__closed__'].tolist())
+
+    # constructed like read_csv, which infers the same dtypes for these values
+    api_lookup = pandas.DataFrame(data, columns=columns)
+    return api_lookup, LookupIndex(api_lookup, dimensions, hierarchy)
+
+
+def normalize_value(value):
+    '''
+    Converts a lookup table cell into an index key. Missing cells become None
+    and whole floats such as ages read as 20.0 become ints
+    :param value: cell of the lookup table
+    :type value: object
+    :return: index key
+    :rtype: object
+    '''
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+class LookupIndex():
+    '''
+    Index over a variable lookup table, mapping each tuple of dimension values
+    to the positions of the rows holding it. Parameters are resolved with
+    dictionary lookups instead of one boolean mask per dimension
+    '''
+
+    def __init__(self, api_lookup, dimensions, hierarchy=None):
+        '''
+        :param api_lookup: variable lookup table, e.g. population.csv
+        :type api_lookup: pandas.DataFrame
+        :param dimensions: columns of api_lookup that parameters filter on
+        :type dimensions: list[str]
+        :param hierarchy: parent position of each row, -1 for none, and
+        whether each row is closed, as stored by write_snapshot. Built from
+        the row labels if None
+        :type hierarchy: tuple
+        '''
+        self.dimensions = list(dimensions)
+        self.index = {}
+        self.values = {dimension: set() for dimension in self.dimensions}
+
+        columns = [api_lookup[dimension].tolist() for dimension in self.dimensions]
+        self.keys = []
+        for position, row in enumerate(zip(*columns)):
+            key = tuple(normalize_value(value) for value in row)
+            self.keys.append(key)
+            self.index.setdefault(key, []).append(position)
+            for dimension, value in zip(self.dimensions, key):
+                if value is not None:
+                    self.values[dimension].add(value)
+
+        self.parents = {}
+        self.children = {}
+        self.closed = set()
+        if hierarchy is not None:
+            parents, closed = hierarchy
+            for position, parent in enumerate(parents):
+                if parent >= 0:
+                    self.parents[position] = parent
+                    self.children.setdefault(parent, []).append(position)
+            self.closed = set(position for position, is_closed in enumerate(closed) if is_closed)
+        elif 'row_label' in api_lookup:
+            self.build_hierarchy(api_lookup['row_id'].tolist(), api_lookup['row_label'].tolist())
+
+    def build_hierarchy(self, row_ids, labels):
+        '''
+        Links each variable to its subtotal within its table, e.g.
+        'Male: !! 5 years' to 'Male:' and 'Male:' to 'Total population'. The
+        parent is the variable labelled with the row_label path minus its
+        last level or, if there is none or its dimension values do not
+        generalize the child's, the most specific variable whose values do.
+        Subtotals whose children refine them along the same dimensions, and
+        that every variable refining them descends from, are sums of their
+        children and recorded in self.closed
+        :param row_ids: variable names, whose last three characters number the
+        variables of each table, e.g. PCT012A001
+        :type row_ids: list[str]
+        :param labels: row_label of each variable
+        :type labels: list[str]
+        :return: None
+        :rtype: None
+        '''
+        groups = {}
+        for position, row_id in enumerate(row_ids):
+            groups.setdefault(row_id[:-3], []).append(position)
+
+        for positions in groups.values():
+            by_path = {}
+            by_key = {}
+            for position in positions:
+                by_path.setdefault(tuple(str(labels[position]).split(LABEL_SEPARATOR)), position)
+                by_key.setdefault(self.keys[position], position)
+
+            generalizations = {}
+            for position in positions:
+                key = self.keys[position]
+                generalizations[position] = [by_key[candidate] for candidate in self.generalized_keys(key)
+                                             if candidate in by_key and by_key[candidate] != position]
+
+                path = tuple(str(labels[position]).split(LABEL_SEPARATOR))
+                parent = by_path.get(path[:-1]) if len(path) > 1 else None
+                if parent is None or not self.generalizes(self.keys[parent], key):
+                    parent = generalizations[position][0] if generalizations[position] else None
+                if parent is not None:
+                    self.parents[position] = parent
+                    self.children.setdefault(parent, []).append(position)
+
+            # subtotals refined by variables outside their subtree are not
+            # the sum of their children
+            incomplete = set()
+            for position in positions:
+                ancestors = set()
+                node = self.parents.get(position)
+                while node is not None and node not in ancestors:
+                    ancestors.add(node)
+                    node = self.parents.get(node)
+                incomplete.update(general for general in generalizations[position] if general not in ancestors)
+
+            for parent in positions:
+                children = self.children.get(parent)
+                if not children or parent in incomplete:
+                    continue
+                keys = [self.keys[child] for child in children]
+                varying = set(frozenset(i for i, value in enumerate(self.keys[parent]) if value != key[i])
+                              for key in keys)
+                if len(varying) == 1 and len(set(keys)) == len(keys):
+                    self.closed.add(parent)
+
+    @staticmethod
+    def generalized_keys(key):
+        '''
+        :param key: dimension values of a variable
+        :type key: tuple
+        :return: keys holding some of the values of key, most values first
+        :rtype: list[tuple]
+        '''
+        set_dimensions = [i for i, value in enumerate(key) if value is not None]
+        result = []
+        for count in range(len(set_dimensions) - 1, -1, -1):
+            for kept in itertools.combinations(set_dimensions, count):
+                result.append(tuple(value if i in kept else None for i, value in enumerate(key)))
+        return result
+
+    @staticmethod
+    def generalizes(parent_key, key):
+        '''
+        :return: whether parent_key holds the values of key, with more of them missing
+        :rtype: bool
+        '''
+        return parent_key != key and all(value is None or value == other for value, other in zip(parent_key, key))
+
+    def minimize(self, positions):
+        '''
+        Rewrites the sum of the variables at positions with fewer variables:
+        complete sets of children are replaced by their closed subtotal, and
+        subtotals whose children are all selected but a few are replaced by
+        the subtotal minus those children
+        :param positions: positions of the selected variables
+        :type positions: list[int]
+        :return: positions and weights, 1 or -1, whose weighted sum equals the
+        sum of the selected variables
+        :rtype: tuple
+        '''
+        selected = set(positions)
+
+        # selected variables and their ancestors, deepest first
+        depth = {}
+        for position in selected:
+            node, path = position, []
+            while node is not None and node not in depth:
+                path.append(node)
+                node = self.parents.get(node)
+            base = depth[node] if node is not None else -1
+            for offset, ancestor in enumerate(reversed(path), 1):
+                depth[ancestor] = base + offset
+
+        terms = {}
+        complete = set()
+        for node in sorted(depth, key=lambda node: -depth[node]):
+            children = self.children.get(node, [])
+            relevant = [child for child in children if child in depth]
+
+            below = [term for child in relevant for term in terms.pop(child)]
+            if node in selected:
+                terms[node] = [(node, 1)] + below
+                if not below:
+                    complete.add(node)
+                continue
+
+            if node in self.closed and all(child in complete for child in relevant):
+                excluded = [(child, -1) for child in children if child not in depth]
+                if not excluded:
+                    terms[node] = [(node, 1)]
+                    complete.add(node)
+                    continue
+                if 1 + len(excluded) < len(below):
+                    below = [(node, 1)] + excluded
+            terms[node] = below
+
+        result = sorted(term for node, node_terms in terms.items() for term in node_terms)
+        return [position for position, _ in result], [weight for _, weight in result]
+
+    def allowed(self, dimension, params):
+        '''
+        Values of a dimension selected by params. A missing parameter selects
+        the rows where the dimension is empty, a list or range selects any of
+        its values and anything else selects that single value
+        :param dimension: column of the lookup table
+        :type dimension: str
+        :param params: parameters as taken by read
+        :type params: dict
+        :return: selected values
+        :rtype: list
+        '''
+        if dimension not in params:
+            return [None]
+
+        param = params[dimension]
+        if isinstance(param, (list, tuple, set, frozenset, range)):
+            return [value for value in self.values[dimension] if value in param]
+        return [value for value in self.values[dimension] if value == param]
+
+    def positions(self, params):
+        '''
+        Positions of the lookup table rows selected by params
+        :param params: parameters as taken by read
+        :type params: dict
+        :return: row positions in lookup table order
+        :rtype: list[int]
+        '''
+        allowed = [self.allowed(dimension, params) for dimension in self.dimensions]
+
+        positions = []
+        for key in itertools.product(*allowed):
+            positions.extend(self.index.get(key, ()))
+        return sorted(positions)
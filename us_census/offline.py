@@ -0,0 +1,239 @@
+__author__ = 'linanqiu'
+
+import logging
+
+logger = logging.getLogger('OfflineStore')
+
+import json
+import os
+import threading
+
+from . import cache as response_cache
+from . import geography
+
+
+class OfflineStore():
+    '''
+    Local copy of whole variable lookup tables, answering queries with column
+    sums over memory-mapped arrays instead of the Census API. Every table and
+    geography level is a directory holding the geography columns of each unit
+    and a column-major matrix of every variable of the table, e.g.
+        path/population/county+state/geo.npz
+        path/population/county+state/values.npy
+        path/population/county+state/variables.json
+        path/population/county+state/filters.json
+    where filters.json lists the geography filters ingested into the level.
+    Units that no filter of their level holds are summed from a finer level
+    whose ingested filters cover them, e.g. Ohio from the counties of Ohio
+    '''
+
+    def __init__(self, path):
+        '''
+        :param path: directory of the store
+        :type path: str
+        '''
+        self.path = path
+        self.levels = {}
+        self.lock = threading.Lock()
+
+    def level_path(self, table, geo):
+        '''
+        Directory of a table at the geography level of geo
+        :param table: name of the reader's table, e.g. 'population'
+        :type table: str
+        :param geo: geography filters. e.g. {'state': 'OH', 'county': '*'}
+        :type geo: dict
+        :return: directory, e.g. path/population/county+state
+        :rtype: str
+        '''
+        return os.path.join(self.path, table, '+'.join(sorted(geo)))
+
+    def load(self, table, geo):
+        '''
+        Opens a table at the geography level of geo, memory-mapping its values
+        :param table: name of the reader's table
+        :type table: str
+        :param geo: geography filters
+        :type geo: dict
+        :return: geography columns, values and the column of each variable
+        :rtype: tuple
+        '''
+        import numpy
+        import pandas
+
+        level_path = self.level_path(table, geo)
+        with self.lock:
+            if level_path in self.levels:
+                return self.levels[level_path]
+
+            if not os.path.exists(os.path.join(level_path, 'variables.json')):
+                msg = 'no offline %s data for %s, ingest it with OfflineStore.ingest' % (table, sorted(geo))
+                raise NotImplementedError(msg)
+
+            with numpy.load(os.path.join(level_path, 'geo.npz')) as arrays:
+                geo_columns = arrays['__columns__'].tolist()
+                geo_frame = pandas.DataFrame({column: arrays['c%d' % i] for i, column in enumerate(geo_columns)},
+                                             columns=geo_columns)
+            values = numpy.load(os.path.join(level_path, 'values.npy'), mmap_mode='r')
+            with open(os.path.join(level_path, 'variables.json')) as variables_file:
+                variables = {symbol: i for i, symbol in enumerate(json.load(variables_file))}
+
+            self.levels[level_path] = (geo_frame, values, variables)
+            return self.levels[level_path]
+
+    def filters(self, table):
+        '''
+        Reads the geography filters ingested into every level of a table
+        :param table: name of the reader's table
+        :type table: str
+        :return: normalized filters
+        :rtype: list[dict]
+        '''
+        table_path = os.path.join(self.path, table)
+        if not os.path.isdir(table_path):
+            return []
+
+        filters = []
+        for level in os.listdir(table_path):
+            try:
+                with open(os.path.join(table_path, level, 'filters.json')) as filters_file:
+                    filters.extend(dict(ingested_geo) for ingested_geo in json.load(filters_file))
+            except OSError:
+                continue
+        return filters
+
+    def answering(self, table, geo):
+        '''
+        Finds the ingested geography filter to answer geo from: a filter of the
+        same level holding every unit of geo, or else the coarsest filter
+        whose units partition the units of geo, see geography.covers
+        :param table: name of the reader's table
+        :type table: str
+        :param geo: normalized geography filter of the units wanted
+        :type geo: dict
+        :return: the answering filter, normalized, or None
+        :rtype: dict
+        '''
+        filters = self.filters(table)
+        for ingested_geo in filters:
+            if set(ingested_geo) == set(geo) and all(ingested_geo[key] in ('*', geo[key]) for key in geo):
+                return ingested_geo
+
+        # coarsest filters first, as they have the fewest units to sum
+        candidates = [ingested_geo for ingested_geo in filters if geography.covers(ingested_geo, geo)]
+        return min(candidates, key=len) if candidates else None
+
+    def query(self, table, symbols, geo):
+        '''
+        Reads variables for the units matching geo, as query_census would.
+        Raises NotImplementedError if no ingested filter holds or covers them
+        :param table: name of the reader's table
+        :type table: str
+        :param symbols: variables to read
+        :type symbols: list[str]
+        :param geo: geography filters. e.g. {'state': 'OH', 'county': '*'}
+        :type geo: dict
+        :return: one row per geography, with geography and variable columns
+        :rtype: pandas.DataFrame
+        '''
+        import numpy
+        import pandas
+
+        normalized = dict(response_cache.normalize_geo(geo))
+        ingested_geo = self.answering(table, normalized)
+        if ingested_geo is None:
+            msg = 'no offline %s data for %s, ingest it with OfflineStore.ingest' % (table, sorted(normalized.items()))
+            raise NotImplementedError(msg)
+
+        if set(ingested_geo) != set(normalized):
+            logger.info('Rolling up %d variables from %s' % (len(symbols), sorted(ingested_geo.items())))
+            dataframe = self.query(table, symbols, ingested_geo)
+            if dataframe.empty:
+                return dataframe
+            return geography.roll_up(dataframe, symbols, ingested_geo, normalized)
+
+        geo_frame, values, variables = self.load(table, geo)
+
+        mask = numpy.ones(len(geo_frame), dtype=bool)
+        for key, value in normalized.items():
+            if value != '*':
+                mask &= geo_frame[geography.geo_column(key, geo)].to_numpy() == value
+        rows = numpy.flatnonzero(mask)
+
+        missing = [symbol for symbol in symbols if symbol not in variables]
+        if missing:
+            raise NotImplementedError('variables not in the offline store: %s' % ', '.join(missing))
+
+        # values are column-major, so selecting variables first reads contiguous columns
+        data = values[:, [variables[symbol] for symbol in symbols]][rows]
+
+        if not len(rows):
+            return pandas.DataFrame()
+
+        return pandas.concat([geo_frame.iloc[rows].reset_index(drop=True),
+                              pandas.DataFrame(data, columns=symbols)], axis=1)
+
+    def ingest(self, reader, geo):
+        '''
+        Fetches every variable of a reader's table for geo from the Census API
+        and adds the units to the store, replacing units ingested before. e.g.
+        store.ingest(DataReader('population', KEY), {'state': 'OH', 'county': '*'})
+        :param reader: reader querying the Census API
+        :type reader: reader.CensusReader
+        :param geo: geography filters
+        :type geo: dict
+        :return: number of units in the level after ingesting
+        :rtype: int
+        '''
+        import numpy
+        import pandas
+
+        symbols = reader.api_lookup['row_id'].tolist()
+        logger.info('Ingesting %d %s variables for %s' % (len(symbols), reader.table, geo))
+        dataframe = reader.fetch_census(symbols, geo)
+        if dataframe.empty:
+            return 0
+
+        geo_columns = [column for column in dataframe.columns if column not in set(symbols)]
+        dataframe = dataframe[geo_columns + symbols]
+
+        level_path = self.level_path(reader.table, geo)
+        if os.path.exists(os.path.join(level_path, 'variables.json')):
+            geo_frame, values, variables = self.load(reader.table, geo)
+            existing = pandas.concat([geo_frame, pandas.DataFrame(numpy.asarray(values), columns=list(variables))],
+                                     axis=1)
+            dataframe = pandas.concat([existing, dataframe], ignore_index=True)
+            dataframe = dataframe.drop_duplicates(subset=geo_columns, keep='last')
+
+        os.makedirs(level_path, exist_ok=True)
+        arrays = {'__columns__': numpy.array(geo_columns)}
+        for i, column in enumerate(geo_columns):
+            arrays['c%d' % i] = dataframe[column].astype(str).to_numpy(dtype=str)
+        values = numpy.asfortranarray(dataframe[symbols].to_numpy(dtype='float64'))
+
+        with self.lock:
+            self.levels.pop(level_path, None)
+            with open(os.path.join(level_path, 'geo.npz.tmp'), 'wb') as geo_file:
+                numpy.savez(geo_file, **arrays)
+            with open(os.path.join(level_path, 'values.npy.tmp'), 'wb') as values_file:
+                numpy.save(values_file, values)
+            with open(os.path.join(level_path, 'variables.json.tmp'), 'w') as variables_file:
+                json.dump(symbols, variables_file)
+            for name in ['geo.npz', 'values.npy', 'variables.json']:
+                os.replace(os.path.join(level_path, name + '.tmp'), os.path.join(level_path, name))
+
+            # filters ingested so far, so that coarser levels can be summed from this one
+            filters = []
+            try:
+                with open(os.path.join(level_path, 'filters.json')) as filters_file:
+                    filters = json.load(filters_file)
+            except OSError:
+                pass
+            normalized = [list(pair) for pair in response_cache.normalize_geo(geo)]
+            if normalized not in filters:
+                filters.append(normalized)
+            with open(os.path.join(level_path, 'filters.json.tmp'), 'w') as filters_file:
+                json.dump(filters, filters_file)
+            os.replace(os.path.join(level_path, 'filters.json.tmp'), os.path.join(level_path, 'filters.json'))
+
+        return len(dataframe)
@@ -0,0 +1,378 @@
+__author__ = 'linanqiu'
+
+# The Census API accepts at most 50 variables per request, and the census
+# module appends GEO_ID to any request above 49 variables
+MAX_VARIABLES = 49
+
+# Number of chunk requests sent to the Census API at the same time
+MAX_WORKERS = 8
+
+# Lists of codes covering at least this share of their geography's units are
+# fetched with one wildcard request and selected locally
+WILDCARD_SHARE = 0.25
+
+# Longest list of codes fetched with one targeted request per code, for
+# geographies whose number of units is not known in advance
+MAX_TARGETED = 3
+
+import logging
+
+logger = logging.getLogger('Query')
+
+import itertools
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from . import stats
+
+
+class ChunkError(Exception):
+    '''
+    Failure of the request of one chunk of variables, after any retries
+    '''
+
+    def __init__(self, symbols, error):
+        '''
+        :param symbols: variables of the chunk
+        :type symbols: list[str]
+        :param error: exception raised by the request
+        :type error: Exception
+        '''
+        super(ChunkError, self).__init__('request of %d variables (%s...) failed: %r' % (len(symbols), symbols[0], error))
+        self.symbols = symbols
+        self.error = error
+
+
+def chunk_symbols(symbols, size=MAX_VARIABLES):
+    '''
+    Splits a list of variables into API sized chunks
+    :param symbols: variables to query
+    :type symbols: list[str]
+    :param size: maximum number of variables per chunk
+    :type size: int
+    :return: list of chunks, each a list of at most size variables
+    :rtype: list[list[str]]
+    '''
+    return [symbols[i:i + size] for i in range(0, len(symbols), size)]
+
+
+def decode_response(data, symbols):
+    '''
+    Decodes the JSON of a Census API response, a header row followed by one
+    row of strings per geography, column by column into typed arrays,
+    without building a dict per row
+    :param data: parsed JSON body
+    :type data: list[list]
+    :param symbols: variables of the request, decoded as float64. Other
+    columns are geography codes, kept as strings
+    :type symbols: list[str]
+    :return: one row per geography, with geography and variable columns
+    :rtype: pandas.DataFrame
+    '''
+    import numpy
+    import pandas
+
+    if len(data) < 2:
+        return pandas.DataFrame()
+
+    variables = set(symbols)
+    columns = {}
+    for name, values in zip(data[0], zip(*data[1:])):
+        if name not in variables:
+            columns[name] = numpy.array(values, dtype=object)
+            continue
+        try:
+            columns[name] = numpy.array(values, dtype='float64')
+        except ValueError:
+            # annotated values, e.g. 'N/A', are treated as missing
+            columns[name] = pandas.to_numeric(pandas.Series(values), errors='coerce').to_numpy(dtype='float64')
+
+    return pandas.DataFrame(columns)
+
+
+def query_chunked(query, symbols, max_workers=MAX_WORKERS):
+    '''
+    Queries symbols in API sized chunks through a bounded thread pool, then
+    joins the partial results on their geography columns
+    :param query: function taking a list of variables and returning one row
+    per geography
+    :type query: callable
+    :param symbols: variables to query
+    :type symbols: list[str]
+    :param max_workers: maximum number of chunks in flight at once
+    :type max_workers: int
+    :return: one row per geography, one column per geography key and variable
+    :rtype: pandas.DataFrame
+    '''
+    chunks = chunk_symbols(symbols)
+
+    def fetch(chunk):
+        with stats.timer('request'):
+            try:
+                return query(chunk)
+            except Exception as error:
+                raise ChunkError(chunk, error) from error
+
+    if len(chunks) <= 1 or max_workers <= 1:
+        frames = [fetch(chunk) for chunk in chunks]
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+            frames = list(executor.map(stats.bind(fetch), chunks))
+
+    with stats.timer('frame'):
+        return merge_chunks(frames, chunks)
+
+
+def query_planned(query, symbols, geo, max_workers=MAX_WORKERS, failures=None):
+    '''
+    Answers a geography filter with lists of codes through the requests
+    planned by plan_geo, sent in parallel, keeping only the listed units.
+    When failures is given, failed requests are reported in it and the
+    units of the other requests are returned
+    :param query: function taking variables and geography filters without
+    lists, and returning one row per geography
+    :type query: callable
+    :param symbols: variables to query
+    :type symbols: list[str]
+    :param geo: geography filters with lists of codes
+    :type geo: dict
+    :param max_workers: maximum number of planned requests in flight at once
+    :type max_workers: int
+    :param failures: list receiving a failure report, from failure, per
+    failed request, or None to raise the first failure
+    :type failures: list
+    :return: one row per listed geography, with geography and variable columns
+    :rtype: pandas.DataFrame
+    '''
+    import pandas
+
+    plan = plan_geo(geo)
+
+    def run(planned_geo):
+        try:
+            return query(symbols, planned_geo)
+        except Exception as error:
+            if failures is None:
+                raise
+            failures.append(failure(planned_geo, symbols, error))
+            return pandas.DataFrame()
+
+    if len(plan) <= 1 or max_workers <= 1:
+        frames = [run(planned_geo) for planned_geo in plan]
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(plan))) as executor:
+            frames = list(executor.map(stats.bind(run), plan))
+
+    return select_units(concat_units(frames), geo)
+
+
+def failure(geo, symbols, error):
+    '''
+    Reports a failed request
+    :param geo: geography filters of the request
+    :type geo: dict
+    :param symbols: variables of the request
+    :type symbols: list[str]
+    :param error: exception raised by the request, a ChunkError if one chunk failed
+    :type error: Exception
+    :return: geo, the variables of the failed chunk, or of the whole request,
+    and the error message
+    :rtype: dict
+    '''
+    logger.warning('Request for %s failed: %s' % (geo, error))
+    if isinstance(error, ChunkError):
+        symbols, error = error.symbols, error.error
+    return {'geo': dict(geo), 'symbols': list(symbols), 'error': repr(error)}
+
+
+def concat_units(frames):
+    '''
+    Stacks the responses of planned requests, skipping empty ones
+    :param frames: responses with the same columns
+    :type frames: list[pandas.DataFrame]
+    :return: stacked responses, empty if all were
+    :rtype: pandas.DataFrame
+    '''
+    import pandas
+
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return pandas.DataFrame()
+    return pandas.concat(frames, ignore_index=True)
+
+
+def merge_chunks(frames, chunks):
+    '''
+    Joins the frames of chunked queries on the columns they share, which are
+    the geography columns returned by the Census API
+    :param frames: results of each chunk query
+    :type frames: list[pandas.DataFrame]
+    :param chunks: variables queried by each chunk, in the same order as frames
+    :type chunks: list[list[str]]
+    :return: joined frame
+    :rtype: pandas.DataFrame
+    '''
+    import pandas
+
+    if not frames or any(frame.empty for frame in frames):
+        return pandas.DataFrame()
+
+    merged = frames[0]
+    for frame, chunk in zip(frames[1:], chunks[1:]):
+        geo_columns = [column for column in frame.columns if column not in chunk]
+        merged = merged.merge(frame, on=geo_columns, how='inner')
+
+    return merged
+
+
+def has_lists(geo):
+    '''
+    :param geo: geography filters
+    :type geo: dict
+    :return: whether any geography is filtered by a list of codes
+    :rtype: bool
+    '''
+    return any(isinstance(value, (list, tuple, set, frozenset)) for value in geo.values())
+
+
+def plan_geo(geo, wildcard_share=WILDCARD_SHARE, max_targeted=MAX_TARGETED):
+    '''
+    Plans the requests answering a geography filter with lists of codes, e.g.
+    {'state': 'OH', 'county': ['035', '049', '061']}. Each list is either
+    replaced by '*', if it selects a large share of the geography's units, or
+    expanded into one request per code. Plans of several lists are crossed,
+    so {'state': ['OH', 'PA'], 'county': ['035', '049']} asks for both
+    counties in both states. Only states and counties are asked for across
+    every state at once, other geographies state by state
+    :param geo: geography filters, each a code, '*' or a list of codes
+    :type geo: dict
+    :param wildcard_share: share of the units of a geography, when their
+    number is known, above which its list is replaced by '*'
+    :type wildcard_share: float
+    :param max_targeted: longest list expanded into targeted requests when
+    the number of units is not known
+    :type max_targeted: int
+    :return: geography filters of the requests, each with single codes or '*'
+    :rtype: list[dict]
+    '''
+    from .cache import normalize_geo
+    from .geography import SHAPES, state_fips_codes
+
+    normalized = normalize_geo(geo)
+    keys = [key for key, _ in normalized]
+    nationwide = SHAPES.get(tuple(keys)) in ('state', 'county')
+
+    options = []
+    for key, value in normalized:
+        if key == 'state' and value == '*' and not nationwide and 'county' in keys:
+            # tracts and subdivisions are only served within a given state
+            options.append(state_fips_codes())
+        elif not isinstance(value, tuple):
+            options.append([value])
+        elif key == 'state':
+            wildcard = nationwide and len(value) >= wildcard_share * len(state_fips_codes())
+            options.append(['*'] if wildcard else list(value))
+        else:
+            options.append(['*'] if len(value) > max_targeted else list(value))
+
+    return [dict(zip(keys, codes)) for codes in itertools.product(*options)]
+
+
+def select_units(dataframe, geo):
+    '''
+    Keeps the rows of a response whose codes are among the lists of geo
+    :param dataframe: response to requests planned by plan_geo
+    :type dataframe: pandas.DataFrame
+    :param geo: geography filters with lists of codes
+    :type geo: dict
+    :return: selected rows, reindexed
+    :rtype: pandas.DataFrame
+    '''
+    import numpy
+
+    from .cache import normalize_code
+    from .geography import FIPS_WIDTHS, geo_column
+
+    if dataframe.empty:
+        return dataframe
+
+    widths = dict(FIPS_WIDTHS, state=2)
+    mask = numpy.ones(len(dataframe), dtype=bool)
+    for key, value in geo.items():
+        if not isinstance(value, (list, tuple, set, frozenset)):
+            continue
+        codes = dataframe[geo_column(key, geo)]
+        if codes.dtype.kind == 'f':
+            codes = codes.astype('int64')
+        codes = codes.astype(str)
+        if key in widths:
+            codes = codes.str.zfill(widths[key])
+        mask &= codes.isin(set(normalize_code(key, code) for code in value)).to_numpy()
+
+    return dataframe[mask].reset_index(drop=True)
+
+
+def flight_key(dataset, symbols, geo):
+    '''
+    Key of a fetch, equal for fetches of the same variables, in any order, and
+    of equivalent geographies
+    :param dataset: year and dataset, e.g. '2010/sf1'
+    :type dataset: str
+    :param symbols: variables to fetch
+    :type symbols: list[str]
+    :param geo: geography filters. e.g. {'state': 'OH', 'county': '*'}
+    :type geo: dict
+    :return: hashable key
+    :rtype: tuple
+    '''
+    from .cache import normalize_geo
+
+    return dataset, frozenset(symbols), tuple(normalize_geo(geo))
+
+
+class SingleFlight():
+    '''
+    Deduplicates concurrent fetches: while a fetch of a key runs, callers
+    asking for the same key wait for it and share its result, or its
+    exception, instead of fetching again
+    '''
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, function, *args):
+        '''
+        Calls function(*args), unless a call of the same key is in flight
+        :param key: hashable key of the call, e.g. from flight_key
+        :type key: tuple
+        :param function: function to call
+        :type function: callable
+        :return: result of function, shared with every concurrent caller of key
+        :rtype: object
+        '''
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Future()
+
+        if not leader:
+            stats.increment('shared_fetches')
+            return call.result()
+
+        try:
+            result = function(*args)
+        except BaseException as error:
+            call.set_exception(error)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+
+# Fetches in flight in this process, shared by every reader
+in_flight = SingleFlight()
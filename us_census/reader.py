@@ -0,0 +1,678 @@
+__author__ = 'linanqiu'
+
+import os.path
+
+import logging
+
+logger = logging.getLogger('CensusReader')
+
+import functools
+import threading
+from collections import OrderedDict
+
+from . import cache as response_cache
+from . import export
+from . import geography
+from . import lookup
+from . import offline as offline_store
+from . import query
+from . import retry
+from . import stats
+
+
+class CensusReader():
+    '''
+    Reader for any table registered in tables, e.g. CensusReader(KEY,
+    spec=tables.get('population')). Subclasses fix the table with the spec
+    class attribute
+    '''
+
+    spec = None
+
+    def __init__(self, CENSUS_API_KEY, max_workers=query.MAX_WORKERS, cache=True, variable_cache=True,
+                 offline=None, spec=None, attempts=retry.MAX_ATTEMPTS, minimize=True,
+                 result_cache=True):
+        '''
+        :param CENSUS_API_KEY: Census API key
+        :type CENSUS_API_KEY: str
+        :param max_workers: maximum number of chunk requests in flight at once
+        :type max_workers: int
+        :param cache: True for the default on-disk response cache, a
+        cache.ResponseCache, or False to disable it
+        :type cache: bool or cache.ResponseCache
+        :param variable_cache: True for the in-memory variable cache shared by
+        every reader, a cache.VariableCache, or False to disable it
+        :type variable_cache: bool or cache.VariableCache
+        :param offline: offline.OfflineStore, or its path, to read instead of the API
+        :type offline: str or offline.OfflineStore
+        :param spec: table to read, defaults to the class's spec
+        :type spec: tables.TableSpec
+        :param attempts: attempts of each request, including the first, see retry.Retrier
+        :type attempts: int
+        :param minimize: query subtotals instead of complete sets of the variables they add up, see resolve
+        :type minimize: bool
+        :param result_cache: True for the in-memory cache of read results shared
+        by every reader, a cache.ResultCache, or False to disable it
+        :type result_cache: bool or cache.ResultCache
+        '''
+        if spec is not None:
+            self.spec = spec
+        if self.spec is None:
+            raise NotImplementedError('CensusReader needs the spec of a table, e.g. tables.get(\'population\')')
+
+        # the census client and lookup table are loaded on first use, so that
+        # constructing a reader stays cheap
+        self.census_api_key = CENSUS_API_KEY
+        self.census_client = None
+        self.lookup_table = None
+        self.lock = threading.RLock()
+
+        self.max_workers = max_workers
+        self.minimize = minimize
+
+        # offline readers answer every query from a local OfflineStore, so
+        # there is nothing to cache
+        if offline is not None and not isinstance(offline, offline_store.OfflineStore):
+            offline = offline_store.OfflineStore(offline)
+        self.offline = offline
+        if offline is not None:
+            cache = variable_cache = result_cache = False
+
+        # True uses the default on-disk cache, False or None disables caching
+        if cache is True:
+            cache = response_cache.ResponseCache()
+        self.cache = cache or None
+
+        # in-memory cache of variable columns, shared by overlapping queries
+        # of every reader
+        if variable_cache is True:
+            variable_cache = response_cache.shared_variable_cache()
+        self.variable_cache = variable_cache or None
+
+        # in-memory cache of whole results, answering repeated reads at once
+        if result_cache is True:
+            result_cache = response_cache.shared_result_cache()
+        self.result_cache = result_cache or None
+
+        # concurrent fetches of the same variables and geography, by this
+        # reader or any other, share one request
+        self.in_flight = query.in_flight
+
+        # transient failures of each chunk request are retried with backoff,
+        # until the circuit breaker shared by every reader opens
+        self.retrier = retry.Retrier(max_attempts=attempts, breaker=retry.census_breaker)
+
+        # callables taking the stats.ReadStats of each completed read
+        self.hooks = []
+
+    @property
+    def table(self):
+        return self.spec.name
+
+    @property
+    def census_api(self):
+        '''
+        Client of the census module for the table's dataset and year, created
+        on first use
+        :return: census client, e.g. census.core.SF1Client
+        :rtype: census.core.Client
+        '''
+        with self.lock:
+            if self.census_client is None:
+                import census
+
+                client = census.Census(self.census_api_key, year=self.spec.year)
+                self.census_client = getattr(client, self.spec.dataset)
+                self.census_client.session.hooks['response'].append(stats.record_response)
+                self.census_client.session.hooks['response'].append(retry.raise_for_transient)
+        return self.census_client
+
+    @census_api.setter
+    def census_api(self, census_api):
+        self.census_client = census_api
+
+    @property
+    def api_lookup(self):
+        '''
+        Variable lookup table, read on first use
+        :return: lookup table created from the table's lookup csv
+        :rtype: pandas.DataFrame
+        '''
+        if self.lookup_table is None:
+            self.read_api_lookup()
+        return self.lookup_table[0]
+
+    @property
+    def api_index(self):
+        '''
+        Index over self.api_lookup, built on first use
+        :return: index of the lookup table
+        :rtype: lookup.LookupIndex
+        '''
+        if self.lookup_table is None:
+            self.read_api_lookup()
+        return self.lookup_table[1]
+
+    def read_api_lookup(self):
+        '''
+        Read or generate the table's variable lookup csv, a variable lookup
+        table to help deccipher the US census API
+        :return: sets self.lookup_table to the dataframe created from the csv
+        and its lookup.LookupIndex, both loaded once per process and shared by
+        every reader
+        :rtype: None
+        '''
+        with self.lock:
+            if not os.path.exists(self.spec.lookup_path):
+                logger.info('%s not found. Downloading variables.xml from census.gov and creating it'
+                            % self.spec.lookup_path)
+                self.spec.create_lookup()
+
+            self.lookup_table = lookup.load_lookup(self.spec.lookup_path, self.spec.dimensions)
+
+    def filter_api_variable(self, params):
+        '''
+        Filters through self.api_lookup to find only the variables that we
+        want to query from US Census API, using the index in self.api_index
+        :param params: parameters as taken by read
+        :type params: dict
+        :return: rows of self.api_lookup of the relevant query variables
+        :rtype: pandas.DataFrame
+        '''
+        for dimension, choices in self.spec.choices.items():
+            values = params.get(dimension, [])
+            if not isinstance(values, (list, tuple, set, frozenset)):
+                values = [values]
+            if any(value not in choices for value in values):
+                msg = '%s must be one of %s or None (for all)' % (dimension, ', '.join(choices))
+                raise NotImplementedError(msg)
+
+        with stats.timer('filter'):
+            return self.api_lookup.iloc[self.api_index.positions(params)]
+
+    def resolve(self, params):
+        '''
+        Variables to query for the total of params. Unless the reader was
+        created with minimize=False, every complete set of variables adding up
+        to a subtotal of the table is replaced by the subtotal, and a subtotal
+        missing only a few of its variables by the subtotal minus those, see
+        lookup.LookupIndex.minimize. Totals are unchanged, but
+        {'sex': 'male', 'age': range(0, 100)} queries 4 variables instead of 100
+        :param params: parameters as taken by read
+        :type params: dict
+        :return: variables and their weights, 1 or -1, in the total
+        :rtype: tuple
+        '''
+        api_variables = self.filter_api_variable(params)
+        logger.debug('Looking up the following variables\n%s', api_variables)
+
+        symbols = api_variables['row_id'].tolist()
+        if not self.minimize:
+            return symbols, [1] * len(symbols)
+
+        with stats.timer('filter'):
+            positions, weights = self.api_index.minimize(api_variables.index)
+            minimized = self.api_lookup['row_id'].take(positions).tolist()
+        stats.increment('variables_minimized', len(symbols) - len(minimized))
+        return minimized, weights
+
+    def read(self, geo, params, breakdown=None, allow_partial=False):
+        '''
+        Queries Census API for the variables selected by params. Readers hold
+        no state of the read, so one reader can serve several threads at once
+        :param geo: geography filters. e.g. {'state': 'OH', 'county': '*'} use '*' for 'all', which would return all
+        as individual rows. Lists of codes, e.g. {'state': 'OH', 'county': ['035', '049']}, return the listed units,
+        fetched with one wildcard request or a few targeted ones, see query.plan_geo
+        :type geo: dict
+        :param params: parameters filtering the dimensions of the table. e.g. {'sex': 'male', 'age': range(20, 25),
+        'race': ['asian', 'white']} for population
+        :type params: dict
+        :param breakdown: dimensions to break the total down by, e.g. ['age', 'race']. Dimensions missing from params
+        cover all their values. All variables are fetched in one query, and one row is returned per geography and
+        combination of the dimensions
+        :type breakdown: list[str]
+        :param allow_partial: return the geographies whose requests succeeded instead of raising when some fail. The
+        failed requests are listed in the result's attrs['failures'], see query.failure
+        :type allow_partial: bool
+        :return: DataFrame of results from query
+        :rtype: pandas.DataFrame
+        '''
+        read_stats = stats.ReadStats(self.spec.name, geo, params)
+        with stats.activate(read_stats), read_stats.timer('total'):
+            failures = [] if allow_partial else None
+            key, result = self.recall(geo, params, breakdown)
+            if result is None:
+                result = self.compute(geo, params, breakdown, failures)
+                self.remember(key, result, failures)
+            if allow_partial:
+                result.attrs['failures'] = failures
+
+        read_stats.increment('rows', len(result))
+        stats.run_hooks(self.hooks, read_stats)
+        return result
+
+    def compute(self, geo, params, breakdown=None, failures=None):
+        '''
+        Reads geo from the caches or the Census API, bypassing
+        self.result_cache
+        :param geo: geography filters, as taken by read
+        :type geo: dict
+        :param params: parameters, as taken by read
+        :type params: dict
+        :param breakdown: dimensions to break the total down by, as taken by read
+        :type breakdown: list[str]
+        :param failures: list receiving the failed requests, see query_partial,
+        or None to raise on failure
+        :type failures: list
+        :return: DataFrame of results from query
+        :rtype: pandas.DataFrame
+        '''
+        # breakdowns sum each cell separately, so their variables are not minimized
+        if breakdown:
+            api_variables = self.filter_api_variable(self.breakdown_params(params, breakdown))
+            symbols = api_variables['row_id'].tolist()
+        else:
+            symbols, weights = self.resolve(params)
+        stats.increment('variables', len(symbols))
+
+        with stats.timer('query'):
+            dataframe = self.query_partial(symbols, geo, failures)
+
+        if breakdown:
+            return self.aggregate_breakdown(dataframe, api_variables, breakdown, geo)
+        return self.aggregate(dataframe, symbols, geo, weights)
+
+    def recall(self, geo, params, breakdown=None):
+        '''
+        Looks up the result of an identical earlier read in self.result_cache
+        :param geo: geography filters, as taken by read
+        :type geo: dict
+        :param params: parameters, as taken by read
+        :type params: dict
+        :param breakdown: dimensions to break the total down by, as taken by read
+        :type breakdown: list[str]
+        :return: the read's cache key, None without a result cache, and a copy
+        of its result, None if it was not read before
+        :rtype: tuple
+        '''
+        if self.result_cache is None:
+            return None, None
+        key = self.result_cache.key(self.spec.census_dataset, self.spec.name, geo, params, breakdown)
+        result = self.result_cache.get(key)
+        stats.increment('result_hits' if result is not None else 'result_misses')
+        return key, result
+
+    def remember(self, key, result, failures=None):
+        '''
+        Stores the result of a read in self.result_cache, unless some of its
+        requests failed
+        :param key: cache key returned by recall
+        :type key: tuple
+        :param result: result of the read
+        :type result: pandas.DataFrame
+        :param failures: failed requests of the read, see query_partial
+        :type failures: list
+        :return: None
+        :rtype: None
+        '''
+        if key is not None and not failures:
+            self.result_cache.add(key, result)
+
+    def add_hook(self, hook):
+        '''
+        Registers a callable taking the stats.ReadStats of every completed read
+        and read_many, e.g. to export per-phase timings as metrics
+        :param hook: callable taking a stats.ReadStats
+        :type hook: callable
+        :return: None
+        :rtype: None
+        '''
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def breakdown_params(self, params, breakdown):
+        '''
+        Widens params to every value of the breakdown dimensions they do not
+        filter on
+        :param params: parameters as taken by read
+        :type params: dict
+        :param breakdown: dimensions to break totals down by
+        :type breakdown: list[str]
+        :return: parameters selecting the variables of every breakdown cell
+        :rtype: dict
+        '''
+        unknown = [dimension for dimension in breakdown if dimension not in self.spec.dimensions]
+        if unknown:
+            raise NotImplementedError('breakdown dimensions must be among %s' % ', '.join(self.spec.dimensions))
+
+        params = dict(params)
+        for dimension in breakdown:
+            params.setdefault(dimension, sorted(self.api_index.values[dimension], key=str))
+        return params
+
+    def read_many(self, specs, allow_partial=False):
+        '''
+        Queries Census API for many (geo, params) pairs at once. The variables
+        of every spec sharing a geography are fetched together in one query
+        :param specs: list of (geo, params) pairs, each as taken by read. e.g.
+        [({'state': 'OH'}, {'type': 'husband_wife'}), ({'state': 'OH'}, {'race': 'asian'})]
+        :type specs: list[tuple]
+        :param allow_partial: return the geographies whose requests succeeded instead of raising when some fail, as
+        in read
+        :type allow_partial: bool
+        :return: one DataFrame of results per spec, in the order of specs
+        :rtype: list[pandas.DataFrame]
+        '''
+        read_stats = stats.ReadStats(self.spec.name)
+        with stats.activate(read_stats), read_stats.timer('total'):
+            results = [None] * len(specs)
+            keys = [None] * len(specs)
+
+            # variables needed by each spec read for the first time, grouped
+            # by normalized geography
+            groups = OrderedDict()
+            for index, (geo, params) in enumerate(specs):
+                keys[index], results[index] = self.recall(geo, params)
+                if results[index] is not None:
+                    if allow_partial:
+                        results[index].attrs['failures'] = []
+                    continue
+                symbols, weights = self.resolve(params)
+
+                key = tuple(response_cache.normalize_geo(geo))
+                groups.setdefault(key, (geo, []))[1].append((index, symbols, weights))
+
+            for geo, members in groups.values():
+                union = list(OrderedDict.fromkeys(symbol for _, symbols, _ in members for symbol in symbols))
+                logger.info('Looking up %d variables for %d specs' % (len(union), len(members)))
+                read_stats.increment('variables', len(union))
+
+                failures = [] if allow_partial else None
+                with read_stats.timer('query'):
+                    dataframe = self.query_partial(union, geo, failures)
+                for index, symbols, weights in members:
+                    results[index] = self.aggregate(dataframe, symbols, geo, weights)
+                    self.remember(keys[index], results[index], failures)
+                    if allow_partial:
+                        results[index].attrs['failures'] = failures
+
+        read_stats.increment('rows', sum(len(result) for result in results))
+        stats.run_hooks(self.hooks, read_stats)
+        return results
+
+    def iter_read(self, geo, params, breakdown=None, by_county=False, batch_size=export.BATCH_SIZE):
+        '''
+        Reads geo state by state, or county by county, yielding the results in
+        bounded DataFrames so that nationwide reads fit in memory. See
+        export.iter_read
+        :param geo: geography filters. e.g. {'state': '*', 'county': '*', 'tract': '*'}
+        :type geo: dict
+        :param params: parameters as taken by read
+        :type params: dict
+        :param breakdown: dimensions to break totals down by, as taken by read
+        :type breakdown: list[str]
+        :param by_county: split each state into its counties
+        :type by_county: bool
+        :param batch_size: maximum number of rows per DataFrame
+        :type batch_size: int
+        :return: generator of DataFrames with the columns of read
+        :rtype: generator
+        '''
+        return export.iter_read(self, geo, params, breakdown, by_county, batch_size)
+
+    def export(self, path, geo, params, by_county=False, max_workers=export.MAX_WORKERS, resume=True):
+        '''
+        Reads geo state by state, or county by county, streaming each partition
+        to a parquet dataset under path. See export.export
+        :param path: directory of the dataset
+        :type path: str
+        :param geo: geography filters. e.g. {'state': '*', 'county': '*', 'tract': '*'}
+        :type geo: dict
+        :param params: parameters as taken by read
+        :type params: dict
+        :param by_county: split each state into its counties
+        :type by_county: bool
+        :param max_workers: number of partitions fetched at the same time
+        :type max_workers: int
+        :param resume: skip the partitions already written by an earlier call of the same export
+        :type resume: bool
+        :return: names of the partitions written by this call
+        :rtype: list[str]
+        '''
+        return export.export(self, path, geo, params, by_county, max_workers, resume)
+
+    def aggregate(self, dataframe, symbols, geo, weights=None):
+        '''
+        Sums symbols into a single int64 total column, and converts the
+        geography columns of geo into state abbreviations and zero-padded codes
+        :param dataframe: result of query_census, which may hold more variables
+        than symbols
+        :type dataframe: pandas.DataFrame
+        :param symbols: variables to sum
+        :type symbols: list[str]
+        :param geo: geography filters
+        :type geo: dict
+        :param weights: weight of each variable, 1 or -1, as returned by resolve, or None to add every variable
+        :type weights: list[int]
+        :return: DataFrame of results from query
+        :rtype: pandas.DataFrame
+        '''
+        import pandas
+
+        cols_keep = list(geo.keys())
+        cols_keep.insert(0, self.spec.column)
+
+        if dataframe.empty:
+            return pandas.DataFrame(columns=cols_keep)
+
+        # horizontal sum of queried tables
+        with stats.timer('sum'):
+            columns = {self.spec.column: geography.sum_columns(dataframe, symbols, weights)}
+        with stats.timer('geography'):
+            columns.update(geography.unit_columns(dataframe, geo))
+
+        return pandas.DataFrame(columns, columns=cols_keep)
+
+    def aggregate_breakdown(self, dataframe, api_variables, breakdown, geo):
+        '''
+        Sums the variables of each combination of the breakdown dimensions into
+        one row per geography and combination
+        :param dataframe: result of query_census, which may hold more variables
+        than api_variables
+        :type dataframe: pandas.DataFrame
+        :param api_variables: rows of self.api_lookup to sum
+        :type api_variables: pandas.DataFrame
+        :param breakdown: dimensions to break totals down by
+        :type breakdown: list[str]
+        :param geo: geography filters
+        :type geo: dict
+        :return: long-format DataFrame of results, with the total column, the
+        geography columns and one column per breakdown dimension
+        :rtype: pandas.DataFrame
+        '''
+        import numpy
+        import pandas
+
+        cols_keep = [self.spec.column] + list(geo.keys()) + list(breakdown)
+
+        if dataframe.empty:
+            return pandas.DataFrame(columns=cols_keep)
+
+        # one column of totals per combination of the breakdown dimensions
+        with stats.timer('sum'):
+            symbols = api_variables['row_id'].tolist()
+            values = dataframe[symbols].to_numpy(dtype='float64')
+            position = {symbol: i for i, symbol in enumerate(symbols)}
+
+            cells = []
+            totals = []
+            for cell, row_ids in api_variables.groupby(list(breakdown), sort=True)['row_id']:
+                cells.append(tuple(lookup.normalize_value(value) for value in cell))
+                cell_values = values[:, [position[row_id] for row_id in row_ids]]
+                totals.append(numpy.nansum(cell_values, axis=1).round().astype('int64'))
+
+        units = numpy.repeat(numpy.arange(len(dataframe)), len(cells))
+        columns = {self.spec.column: numpy.column_stack(totals).ravel() if cells else numpy.zeros(0, dtype='int64')}
+        with stats.timer('geography'):
+            for key, column in geography.unit_columns(dataframe, geo).items():
+                columns[key] = column.iloc[units].reset_index(drop=True)
+        cell_positions = numpy.tile(numpy.arange(len(cells)), len(dataframe))
+        for i, dimension in enumerate(breakdown):
+            columns[dimension] = pandas.Series([cell[i] for cell in cells]).take(cell_positions).reset_index(drop=True)
+
+        return pandas.DataFrame(columns, columns=cols_keep)
+
+    def query_partial(self, symbols, geo, failures=None):
+        '''
+        Queries symbols for geo, reporting failed requests in failures
+        instead of raising when failures is given
+        :param symbols: variables to query
+        :type symbols: list[str]
+        :param geo: geography filters
+        :type geo: dict
+        :param failures: list receiving a report per failed request, or None
+        :type failures: list
+        :return: one row per geography whose request succeeded
+        :rtype: pandas.DataFrame
+        '''
+        if failures is None:
+            return self.query_census(symbols, geo)
+        return query.query_planned(self.query_census, symbols, geo, self.max_workers, failures)
+
+    def query_census(self, symbols, geo):
+        '''
+        Queries US census for symbols, fetching only the variables that
+        self.variable_cache does not hold yet for geo and cannot sum from the
+        cached variables of finer geographies. Lists of codes are answered
+        through the requests planned by query.plan_geo
+        :param symbols: variables from http://api.census.gov/data/2010/sf1/variables.html to query
+        :type symbols: list[str]
+        :param geo: geography filters
+        :type geo: dict
+        :return: one row per geography, with geography and variable columns
+        :rtype: pandas.DataFrame
+        '''
+        if query.has_lists(geo):
+            return query.query_planned(self.query_census, symbols, geo, self.max_workers)
+
+        if self.variable_cache is None:
+            return self.fetch_census(symbols, geo)
+
+        key = self.variable_cache.key(self.spec.census_dataset, geo)
+        missing = self.variable_cache.missing(key, symbols)
+        stats.increment('variables_cached', len(symbols) - len(missing))
+        if missing:
+            unanswered = self.variable_cache.roll_up(key, missing)
+            stats.increment('variables_rolled_up', len(missing) - len(unanswered))
+            missing = unanswered
+        if missing:
+            logger.info('Fetching %d of %d variables' % (len(missing), len(symbols)))
+            stats.increment('variables_fetched', len(missing))
+            fetched = self.fetch_census(missing, geo)
+            if fetched.empty:
+                return fetched
+            self.variable_cache.add(key, fetched, missing)
+
+        dataframe = self.variable_cache.get(key, symbols)
+        if dataframe is None:
+            # other threads evicted some of the variables since they were
+            # counted or added, so fetch them all without the cache
+            logger.info('Fetching %d evicted variables' % len(symbols))
+            stats.increment('variables_fetched', len(symbols))
+            dataframe = self.fetch_census(symbols, geo)
+        return dataframe
+
+    def fetch_census(self, symbols, geo):
+        '''
+        Fetches symbols, unless the same variables are being fetched for geo
+        already, in which case the result of that fetch is shared. Offline
+        readers read from self.offline instead
+        :param symbols: variables to fetch
+        :type symbols: list[str]
+        :param geo: geography filters
+        :type geo: dict
+        :return: one row per geography, with geography and variable columns,
+        to be treated as read-only since it may be shared
+        :rtype: pandas.DataFrame
+        '''
+        if query.has_lists(geo):
+            return query.query_planned(self.fetch_census, symbols, geo, self.max_workers)
+
+        if self.offline is not None:
+            stats.increment('offline_reads')
+            return self.offline.query(self.spec.name, symbols, geo)
+
+        key = query.flight_key(self.spec.census_dataset, symbols, geo)
+        return self.in_flight.do(key, self.fetch_response, symbols, geo)
+
+    def fetch_response(self, symbols, geo):
+        '''
+        Fetches symbols in chunks of at most query.MAX_VARIABLES variables,
+        sending up to self.max_workers chunks concurrently, each retried by
+        self.retrier. Responses are read
+        from and written to self.cache when caching is enabled
+        :param symbols: variables to fetch
+        :type symbols: list[str]
+        :param geo: geography filters
+        :type geo: dict
+        :return: one row per geography, with geography and variable columns
+        :rtype: pandas.DataFrame
+        '''
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(self.spec.census_dataset, symbols, geo)
+            dataframe = self.cache.get(key)
+            if dataframe is not None:
+                logger.info('Read response from cache ' + key)
+                stats.increment('cache_hits')
+                return dataframe
+            stats.increment('cache_misses')
+
+        chunk_query = functools.partial(self.retrier.call, self.query_census_chunk, geo=geo)
+        dataframe = query.query_chunked(chunk_query, symbols, self.max_workers)
+
+        if key is not None and not dataframe.empty:
+            self.cache.set(key, dataframe)
+
+        return dataframe
+
+    def query_census_chunk(self, symbols, geo):
+        '''
+        Queries US census for one chunk of variables through the census
+        client's session, decoding the JSON response straight into typed
+        columns
+        :param symbols: at most query.MAX_VARIABLES variables to query
+        :type symbols: list[str]
+        :param geo: geography filters, each a code or '*'
+        :type geo: dict
+        :return: one row per geography, with string geography columns and
+        float64 variable columns
+        :rtype: pandas.DataFrame
+        '''
+        import json
+
+        import pandas
+        from census.core import APIKeyError, CensusException
+
+        params = geography.api_clauses(geo)
+        params['get'] = ','.join(symbols)
+        params['key'] = self.census_api_key
+
+        logger.info('Querying using filters: ' + str(geo))
+
+        response = self.census_api.session.get(self.spec.url, params=params)
+        if response.status_code == 204:
+            return pandas.DataFrame()
+        if response.status_code != 200:
+            raise CensusException(response.text)
+
+        with stats.timer('decode'):
+            try:
+                data = json.loads(response.content)
+            except ValueError:
+                if '<title>Invalid Key</title>' in response.text:
+                    raise APIKeyError(' '.join(response.text.splitlines()))
+                raise
+            return query.decode_response(data, symbols)
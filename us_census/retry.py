@@ -0,0 +1,288 @@
+__author__ = 'linanqiu'
+
+# Attempts of each Census API request, including the first
+MAX_ATTEMPTS = 5
+
+# Backoff before the second attempt, doubled for each later attempt, in
+# seconds. Each delay is drawn uniformly between 0 and the backoff
+BACKOFF = 0.5
+
+# Longest backoff between two attempts, in seconds
+MAX_BACKOFF = 30.0
+
+# Longest wait asked by a Retry-After header that is honored, in seconds
+MAX_RETRY_AFTER = 300.0
+
+# Consecutive transient failures after which the circuit breaker opens
+FAILURE_THRESHOLD = 10
+
+# Seconds the circuit breaker stays open before letting requests through again
+RESET_TIMEOUT = 30.0
+
+# HTTP statuses of responses worth retrying: throttling and server errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+import logging
+
+logger = logging.getLogger('Retry')
+
+import random
+import threading
+import time
+
+from . import stats
+
+
+class TransientError(Exception):
+    '''
+    Census API response worth retrying, raised by raise_for_transient
+    '''
+
+    def __init__(self, status, retry_after=None, text=''):
+        '''
+        :param status: HTTP status of the response
+        :type status: int
+        :param retry_after: seconds to wait asked by the Retry-After header, if any
+        :type retry_after: float
+        :param text: body of the response
+        :type text: str
+        '''
+        super(TransientError, self).__init__('HTTP %d: %s' % (status, text[:200]))
+        self.status = status
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(Exception):
+    '''
+    Raised instead of sending a request while the circuit breaker is open
+    '''
+
+
+def parse_retry_after(value):
+    '''
+    :param value: Retry-After header, in seconds or as an HTTP date
+    :type value: str
+    :return: seconds to wait, or None if the header is missing or invalid
+    :rtype: float
+    '''
+    import email.utils
+
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def raise_for_transient(response, *args, **kwargs):
+    '''
+    requests response hook raising TransientError for throttling and server
+    error responses, which the census module reports without their status
+    and headers
+    :param response: response of a Census API request
+    :type response: requests.Response
+    :return: the response, unchanged
+    :rtype: requests.Response
+    '''
+    if response.status_code in RETRY_STATUSES:
+        raise TransientError(response.status_code, parse_retry_after(response.headers.get('Retry-After')),
+                             response.text)
+    return response
+
+
+def is_transient(error):
+    '''
+    :param error: exception raised by a request
+    :type error: Exception
+    :return: whether retrying the request may succeed
+    :rtype: bool
+    '''
+    import requests
+
+    return isinstance(error, (TransientError, requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+
+class CircuitBreaker():
+    '''
+    Stops sending requests for reset_timeout seconds after threshold
+    consecutive transient failures, so that an outage fails reads at once
+    instead of after every retry. After the timeout a single probe request
+    is let through while every other request still fails: the breaker closes
+    if the probe gets a response and opens again if it fails. A probe that
+    reports nothing, e.g. because it was cancelled, is replaced by another
+    after reset_timeout seconds
+    '''
+
+    def __init__(self, threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        '''
+        :param threshold: consecutive transient failures opening the breaker
+        :type threshold: int
+        :param reset_timeout: seconds the breaker stays open
+        :type reset_timeout: float
+        '''
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened = None
+        self.probing = None
+        self.lock = threading.Lock()
+
+    def check(self):
+        '''
+        Raises CircuitOpenError while the breaker is open, except for the
+        single probe request let through after the timeout
+        :return: None
+        :rtype: None
+        '''
+        with self.lock:
+            if self.opened is None:
+                return
+            now = time.monotonic()
+            remaining = self.opened + self.reset_timeout - now
+            if remaining > 0:
+                raise CircuitOpenError('Census API failing, not retrying for %.0f seconds' % remaining)
+            if self.probing is not None and now - self.probing < self.reset_timeout:
+                raise CircuitOpenError('Census API failing, waiting for a probe request')
+            self.probing = now
+
+    def record(self, success):
+        '''
+        Records the outcome of a request
+        :param success: whether the request got a response, as opposed to failing transiently
+        :type success: bool
+        :return: None
+        :rtype: None
+        '''
+        with self.lock:
+            if success:
+                self.failures = 0
+                self.opened = self.probing = None
+                return
+            self.failures += 1
+            if self.probing is not None:
+                logger.warning('Probe request failed, keeping the circuit breaker open')
+                self.opened = time.monotonic()
+                self.probing = None
+            elif self.failures >= self.threshold and self.opened is None:
+                logger.warning('Opening circuit breaker after %d consecutive failures' % self.failures)
+                self.opened = time.monotonic()
+
+
+class Retrier():
+    '''
+    Retries transient failures of a request with jittered exponential
+    backoff, waiting as long as asked by Retry-After headers
+    '''
+
+    def __init__(self, max_attempts=MAX_ATTEMPTS, backoff=BACKOFF, max_backoff=MAX_BACKOFF, breaker=None):
+        '''
+        :param max_attempts: attempts of each request, including the first, at least one
+        :type max_attempts: int
+        :param backoff: backoff before the second attempt, in seconds
+        :type backoff: float
+        :param max_backoff: longest backoff, in seconds
+        :type max_backoff: float
+        :param breaker: circuit breaker checked before each attempt, or None
+        :type breaker: CircuitBreaker
+        '''
+        self.max_attempts = max(1, max_attempts)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = breaker
+
+    def delay(self, attempt, error):
+        '''
+        :param attempt: number of the failed attempt, starting at 0
+        :type attempt: int
+        :param error: exception of the failed attempt
+        :type error: Exception
+        :return: seconds to wait before the next attempt
+        :rtype: float
+        '''
+        retry_after = getattr(error, 'retry_after', None)
+        if retry_after is not None:
+            return min(retry_after, MAX_RETRY_AFTER)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def attempt(self, attempt, error):
+        '''
+        Records a failed attempt
+        :param attempt: number of the failed attempt, starting at 0
+        :type attempt: int
+        :param error: exception of the failed attempt
+        :type error: Exception
+        :return: seconds to wait before retrying, or None to give up
+        :rtype: float
+        '''
+        if not is_transient(error):
+            # the API answered, so it is up even though the request failed
+            if self.breaker is not None:
+                self.breaker.record(True)
+            return None
+        if self.breaker is not None:
+            self.breaker.record(False)
+        if attempt + 1 >= self.max_attempts:
+            return None
+
+        delay = self.delay(attempt, error)
+        logger.info('Retrying in %.1fs after attempt %d failed: %s' % (delay, attempt + 1, error))
+        stats.increment('retries')
+        return delay
+
+    def call(self, function, *args, **kwargs):
+        '''
+        Calls function, retrying transient failures
+        :param function: function sending a request
+        :type function: callable
+        :return: result of function
+        :rtype: object
+        '''
+        for attempt in range(self.max_attempts):
+            if self.breaker is not None:
+                self.breaker.check()
+            try:
+                result = function(*args, **kwargs)
+            except Exception as error:
+                delay = self.attempt(attempt, error)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+            else:
+                if self.breaker is not None:
+                    self.breaker.record(True)
+                return result
+
+    async def call_async(self, function, *args, **kwargs):
+        '''
+        Awaitable version of call, for coroutine functions
+        :param function: coroutine function sending a request
+        :type function: callable
+        :return: result of function
+        :rtype: object
+        '''
+        import asyncio
+
+        for attempt in range(self.max_attempts):
+            if self.breaker is not None:
+                self.breaker.check()
+            try:
+                result = await function(*args, **kwargs)
+            except Exception as error:
+                delay = self.attempt(attempt, error)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+            else:
+                if self.breaker is not None:
+                    self.breaker.record(True)
+                return result
+
+
+# Circuit breaker shared by every reader of the process, as they all depend
+# on the same API
+census_breaker = CircuitBreaker()
@@ -0,0 +1,198 @@
+__author__ = 'linanqiu'
+
+import logging
+
+logger = logging.getLogger('ReadStats')
+
+import contextlib
+import contextvars
+import threading
+import time
+from collections import defaultdict
+
+# ReadStats of the read running in the current thread or asyncio task
+current_stats = contextvars.ContextVar('current_stats', default=None)
+
+
+class ReadStats():
+    '''
+    Timings and counters of one read, passed to the hooks of the reader once
+    the read completes. Phases running in several threads at once, such as
+    chunk requests, add up their durations, so they can exceed the total.
+
+    Phases, in seconds:
+        filter: resolving parameters to variables in the lookup table
+        query: getting the variables, from the caches or the Census API
+        request: chunk requests, including decoding
+        http: waiting for Census API responses, as measured by requests
+        decode: decoding JSON responses into typed columns
+        frame: merging the DataFrames of chunk responses
+        sum: summing variables into totals
+        geography: converting FIPS codes into abbreviations and padded codes
+        total: the whole read
+
+    Counters:
+        requests, bytes_received: Census API requests and their body sizes
+        retries: requests sent again after a transient failure
+        cache_hits, cache_misses: responses found or not in the disk cache
+        result_hits, result_misses: reads answered or not by the result cache
+        variables: variables queried for the parameters
+        variables_minimized: variables not queried because a subtotal adds
+        them up, see CensusReader.resolve
+        variables_cached, variables_rolled_up, variables_fetched: variables
+        served by the variable cache, summed from finer geographies, or
+        fetched
+        offline_reads: queries answered by an offline store
+        shared_fetches: fetches answered by an identical fetch already in
+        flight
+        rows: rows returned
+    '''
+
+    def __init__(self, table, geo=None, params=None):
+        '''
+        :param table: name of the reader's table, e.g. 'population'
+        :type table: str
+        :param geo: geography filters of the read
+        :type geo: dict
+        :param params: parameters of the read
+        :type params: dict
+        '''
+        self.table = table
+        self.geo = geo
+        self.params = params
+        self.phases = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def timer(self, phase):
+        '''
+        Adds the duration of the with block to a phase
+        :param phase: name of the phase, e.g. 'filter'
+        :type phase: str
+        '''
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.add_time(phase, time.perf_counter() - start)
+
+    def add_time(self, phase, seconds):
+        with self.lock:
+            self.phases[phase] += seconds
+
+    def increment(self, counter, count=1):
+        with self.lock:
+            self.counters[counter] += count
+
+    def as_dict(self):
+        '''
+        Flattens the stats for metrics exporters
+        :return: phase durations as '<phase>_seconds' and counters
+        :rtype: dict
+        '''
+        with self.lock:
+            result = {'%s_seconds' % phase: seconds for phase, seconds in self.phases.items()}
+            result.update(self.counters)
+        return result
+
+    def __repr__(self):
+        return 'ReadStats(%s, %s)' % (self.table, self.as_dict())
+
+
+@contextlib.contextmanager
+def activate(read_stats):
+    '''
+    Makes read_stats the stats of the current thread or asyncio task for the
+    with block, so that timer, increment and record_response report to it
+    :param read_stats: stats of the read
+    :type read_stats: ReadStats
+    '''
+    token = current_stats.set(read_stats)
+    try:
+        yield read_stats
+    finally:
+        current_stats.reset(token)
+
+
+def bind(function):
+    '''
+    Wraps function to run with the stats of the caller, for functions sent to
+    thread pools, which do not inherit them
+    :param function: function to wrap
+    :type function: callable
+    :return: wrapped function
+    :rtype: callable
+    '''
+    context = contextvars.copy_context()
+
+    def bound(*args, **kwargs):
+        return context.copy().run(function, *args, **kwargs)
+
+    return bound
+
+
+@contextlib.contextmanager
+def timer(phase):
+    '''
+    Adds the duration of the with block to a phase of the current stats, if
+    any
+    :param phase: name of the phase, e.g. 'filter'
+    :type phase: str
+    '''
+    read_stats = current_stats.get()
+    if read_stats is None:
+        yield None
+    else:
+        with read_stats.timer(phase):
+            yield read_stats
+
+
+def increment(counter, count=1):
+    '''
+    Increments a counter of the current stats, if any
+    :param counter: name of the counter, e.g. 'cache_hits'
+    :type counter: str
+    :param count: amount to add
+    :type count: int
+    :return: None
+    :rtype: None
+    '''
+    read_stats = current_stats.get()
+    if read_stats is not None:
+        read_stats.increment(counter, count)
+
+
+def record_response(response, *args, **kwargs):
+    '''
+    requests response hook counting Census API requests, the bytes received
+    and the time spent waiting for them in the current stats
+    :param response: response of a Census API request
+    :type response: requests.Response
+    :return: the response, unchanged
+    :rtype: requests.Response
+    '''
+    read_stats = current_stats.get()
+    if read_stats is not None:
+        read_stats.increment('requests')
+        read_stats.increment('bytes_received', len(response.content))
+        read_stats.add_time('http', response.elapsed.total_seconds())
+    return response
+
+
+def run_hooks(hooks, read_stats):
+    '''
+    Calls each hook with the stats of a completed read. Failing hooks are
+    logged and do not fail the read
+    :param hooks: callables taking a ReadStats
+    :type hooks: list[callable]
+    :param read_stats: stats of the read
+    :type read_stats: ReadStats
+    :return: None
+    :rtype: None
+    '''
+    for hook in hooks:
+        try:
+            hook(read_stats)
+        except Exception:
+            logger.exception('Read hook %r failed' % hook)
@@ -0,0 +1,128 @@
+__author__ = 'linanqiu'
+
+import os.path
+
+# Directory of the variable lookup csvs shipped with the package
+LOOKUP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api_variable_lookup')
+
+# Census API endpoint of a decennial census dataset, by year and dataset
+API_URL = 'https://api.census.gov/data/%d/dec/%s'
+
+
+class TableSpec():
+    '''
+    Declarative description of a Census table read by reader.CensusReader:
+    where its variables are queried, how its variable lookup table is built
+    and which of its columns parameters filter on
+    '''
+
+    def __init__(self, name, prefix, dimensions, column, dataset='sf1', year=2010, lookup_path=None, choices=None,
+                 classifier=None, url=None):
+        '''
+        :param name: name of the table, as taken by DataReader, e.g. 'population'
+        :type name: str
+        :param prefix: prefix of the table's variables, e.g. 'PCT012'
+        :type prefix: str
+        :param dimensions: columns of the lookup table that parameters filter on
+        :type dimensions: list[str]
+        :param column: name of the total column returned by read, e.g. 'population'
+        :type column: str
+        :param dataset: attribute of census.Census holding the dataset's client, e.g. 'sf1'
+        :type dataset: str
+        :param year: year of the dataset
+        :type year: int
+        :param lookup_path: path of the variable lookup csv, defaults to <name>.csv in LOOKUP_DIR
+        :type lookup_path: str
+        :param choices: allowed values of dimensions that only take a few, e.g. {'sex': ['male', 'female']}
+        :type choices: dict
+        :param classifier: 'module:function' adding the dimension columns to the table's variables when generating
+        the lookup csv, see api_variable_lookup.generate
+        :type classifier: str
+        :param url: Census API endpoint of the dataset, defaults to API_URL for year and dataset
+        :type url: str
+        '''
+        self.name = name
+        self.prefix = prefix
+        self.dimensions = list(dimensions)
+        self.column = column
+        self.dataset = dataset
+        self.year = year
+        self.lookup_path = lookup_path or os.path.join(LOOKUP_DIR, '%s.csv' % name)
+        self.choices = choices or {}
+        self.classifier = classifier
+        self.url = url or API_URL % (year, dataset)
+
+    @property
+    def census_dataset(self):
+        '''
+        Year and dataset, used to key cached responses
+        :return: e.g. '2010/sf1'
+        :rtype: str
+        '''
+        return '%d/%s' % (self.year, self.dataset)
+
+    def create_lookup(self):
+        '''
+        Generates the variable lookup csv, along with the missing csvs of
+        every other registered table, in one pass over variables.xml
+        :return: None
+        :rtype: None
+        '''
+        if self.classifier is None:
+            raise NotImplementedError('no lookup table found for %s at %s' % (self.name, self.lookup_path))
+
+        from .api_variable_lookup import generate
+
+        missing = [spec for spec in TABLES.values()
+                   if spec is not self and spec.classifier is not None and not os.path.exists(spec.lookup_path)]
+        generate.create_lookups([self] + missing)
+
+    def __repr__(self):
+        return 'TableSpec(%s, %s %s)' % (self.name, self.census_dataset, self.prefix)
+
+
+# Registered tables by name
+TABLES = {}
+
+
+def register(spec):
+    '''
+    Registers a table, making it readable with DataReader(spec.name, ...)
+    :param spec: table to register, replacing any table of the same name
+    :type spec: TableSpec
+    :return: spec
+    :rtype: TableSpec
+    '''
+    TABLES[spec.name] = spec
+    return spec
+
+
+def get(name):
+    '''
+    Looks up a registered table
+    :param name: name of the table, e.g. 'population'
+    :type name: str
+    :return: the table's spec
+    :rtype: TableSpec
+    '''
+    if name not in TABLES:
+        raise NotImplementedError('table must be one of %s' % ', '.join(sorted(TABLES)))
+    return TABLES[name]
+
+
+POPULATION = register(TableSpec(
+    name='population',
+    prefix='PCT012',
+    dimensions=['sex', 'age', 'race', 'hispanic_latino_origin'],
+    column='population',
+    choices={'sex': ['male', 'female']},
+    classifier='us_census.api_variable_lookup.generate:classify_population',
+))
+
+HOUSEHOLD = register(TableSpec(
+    name='household',
+    prefix='P038',
+    dimensions=['type', 'has_children', 'children_age', 'race', 'hispanic_latino_origin'],
+    column='households',
+    classifier='us_census.api_variable_lookup.generate:classify_household',
+))
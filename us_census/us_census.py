@@ -1,19 +1,42 @@
 __author__ = 'linanqiu'
 
-from . import population
 from . import household
+from . import population
+from . import reader
+from . import tables
+
+# Reader classes of the tables shipped with the package. Other registered
+# tables are read with reader.CensusReader
+READERS = {
+    'population': population.PopulationReader,
+    'household': household.HouseholdReader,
+}
 
 
-def DataReader(variable, CENSUS_API_KEY):
+def DataReader(variable, CENSUS_API_KEY, async_=False, **kwargs):
     '''
-    Switcher function to choose between PopulationReader and HouseholdReader
-    :param variable: 'population' or 'household'
+    Switcher function returning the reader of a table registered in tables
+    :param variable: name of the table, e.g. 'population' or 'household'
     :type variable: str
-    :return: instance of population.PopulationReader or
-    household.HouseholdReader
-    :rtype: population.PopulationReader or household.HouseholdReader
+    :param async_: return a reader of aio, whose read and read_many are awaitable
+    :type async_: bool
+    :param kwargs: passed on to the reader, e.g. max_workers, cache, variable_cache
+    or offline, the path of an offline.OfflineStore to read instead of the API
+    :type kwargs: dict
+    :return: instance of population.PopulationReader, household.HouseholdReader
+    or reader.CensusReader for other tables
+    :rtype: reader.CensusReader
     '''
-    if variable == 'population':
-        return population.PopulationReader(CENSUS_API_KEY)
-    if variable == 'household':
-        return household.HouseholdReader(CENSUS_API_KEY)
+    spec = tables.get(variable)
+
+    if async_:
+        from . import aio
+
+        async_readers = {'population': aio.AsyncPopulationReader, 'household': aio.AsyncHouseholdReader}
+        if variable in async_readers:
+            return async_readers[variable](CENSUS_API_KEY, **kwargs)
+        return aio.AsyncCensusReader(CENSUS_API_KEY, spec=spec, **kwargs)
+
+    if variable in READERS:
+        return READERS[variable](CENSUS_API_KEY, **kwargs)
+    return reader.CensusReader(CENSUS_API_KEY, spec=spec, **kwargs)